@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from urllib.error import URLError
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_backends
+from load_test import percentile
+
+
+POLL_INTERVAL = 0.02
+
+
+def build_command(args):
+  if args.command:
+    return shlex.split(args.command), dict(os.environ)
+  service_dir = fake_backends.SERVICES[args.service][0]
+  env = dict(os.environ, PORT=str(args.port), BENCH_SERVICE=args.service,
+             STATE_STORE='memory://', WORKERS=str(args.workers))
+  return [
+    sys.executable, '-m', 'gunicorn',
+    '--config', os.path.join(fake_backends.REPO_DIR, service_dir,
+                             'gunicorn.conf.py'),
+    '--chdir', os.path.dirname(os.path.abspath(__file__)),
+    'fake_wsgi:app'
+  ], env
+
+
+def wait_for_response(url, process, timeout):
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    if process.poll() is not None:
+      raise RuntimeError('Server exited with code ' + str(process.returncode))
+    try:
+      with urlopen(url, timeout=1) as response:
+        if response.status == 200:
+          return
+    except (URLError, ConnectionError, OSError):
+      pass
+    time.sleep(POLL_INTERVAL)
+  raise RuntimeError('No response from ' + url + ' within '
+                     + str(timeout) + ' seconds')
+
+
+def measure(args):
+  command, env = build_command(args)
+  url = args.url or 'http://127.0.0.1:' + str(args.port) + '/slackQueueStats'
+  started = time.monotonic()
+  process = subprocess.Popen(
+    command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+  )
+  try:
+    wait_for_response(url, process, args.timeout)
+    return time.monotonic() - started
+  finally:
+    process.terminate()
+    try:
+      process.wait(timeout=args.timeout)
+    except subprocess.TimeoutExpired:
+      process.kill()
+      process.wait()
+
+
+def parse_args(argv):
+  parser = argparse.ArgumentParser(
+    description='Measure the time from starting a server to its first '
+    'successful response.'
+  )
+  parser.add_argument('service', choices=sorted(fake_backends.SERVICES))
+  parser.add_argument('--runs', type=int, default=5)
+  parser.add_argument('--port', type=int, default=5055)
+  parser.add_argument('--workers', type=int, default=1)
+  parser.add_argument('--timeout', type=float, default=60)
+  parser.add_argument('--command',
+                      help='Start command to measure instead of gunicorn '
+                      'with fake backends, e.g. a docker run command.')
+  parser.add_argument('--url',
+                      help='URL polled until it answers with 200. Default is '
+                      '/slackQueueStats on --port.')
+  parser.add_argument('--json', action='store_true',
+                      help='Print the report as JSON.')
+  return parser.parse_args(argv)
+
+
+def main(argv=None):
+  args = parse_args(argv)
+  durations = [measure(args) for _ in range(max(1, args.runs))]
+  report = {
+    'service': args.service,
+    'runs': len(durations),
+    'secondsToFirstResponse': [round(value, 3) for value in durations],
+    'p50': round(percentile(durations, 0.50), 3),
+    'max': round(max(durations), 3)
+  }
+  if args.json:
+    print(json.dumps(report, indent=2, sort_keys=True))
+  else:
+    print('service              ' + report['service'])
+    print('runs                 ' + str(report['runs']))
+    print('first response p50   ' + str(report['p50']) + ' s')
+    print('first response max   ' + str(report['max']) + ' s')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,340 @@
+import collections
+import datetime
+import importlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from email.feedparser import FeedParser
+from urllib.parse import parse_qs, unquote, urlparse
+
+import google.auth
+import google.cloud.logging
+import httplib2
+import requests
+from google.auth.credentials import AnonymousCredentials
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = {
+  'db': ('db_backups', 'app'),
+  'iam': ('iam_backups', 'iam_backup')
+}
+BACKUP_RUNS_PATTERN = re.compile(
+  r'/sql/v1beta4/projects/[^/]+/instances/([^/]+)/backupRuns$'
+)
+INSTANCES_PATTERN = re.compile(r'/sql/v1beta4/projects/[^/]+/instances$')
+OPERATION_PATTERN = re.compile(r'/sql/v1beta4/projects/[^/]+/operations/(.+)$')
+ACCOUNTS_PATTERN = re.compile(r'/v1/projects/[^/]+/serviceAccounts$')
+KEYS_PATTERN = re.compile(r'/v1/projects/[^/]+/serviceAccounts/([^/]+)/keys$')
+PROJECTS_PATTERN = re.compile(r'/v1/projects$')
+FOLDERS_PATTERN = re.compile(r'/v2/folders$')
+POLICY_PATTERN = re.compile(r'/v1/projects/([^/]+):getIamPolicy$')
+
+
+def format_time(moment):
+  return moment.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+class LatencyModel(object):
+
+  def __init__(self, latency, jitter, error_rate):
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+
+  def wait(self):
+    delay = self.latency + random.uniform(0, self.jitter)
+    if delay > 0:
+      time.sleep(delay)
+
+  def fail(self):
+    return self.error_rate > 0 and random.random() < self.error_rate
+
+
+class FakeGoogleBackend(object):
+
+  def __init__(self, latency_model, instances=0, accounts=0, projects=1,
+               keys_per_account=2, late_rate=0.0, expired_rate=0.0,
+               instances_page_size=500):
+    self.latency_model = latency_model
+    self.instances = ['instance-' + str(index) for index in range(instances)]
+    self.accounts = [
+      'account-' + str(index) + '@bench.iam.gserviceaccount.com'
+      for index in range(accounts)
+    ]
+    self.projects = ['bench-project-' + str(index) for index in range(projects)]
+    self.keys_per_account = keys_per_account
+    self.late_rate = late_rate
+    self.expired_rate = expired_rate
+    self.instances_page_size = instances_page_size
+    self.started = datetime.datetime.utcnow()
+    self.calls = collections.Counter()
+    self.lock = threading.Lock()
+
+  def count(self, name):
+    with self.lock:
+      self.calls[name] += 1
+
+  def handle(self, uri, method, body, headers):
+    self.latency_model.wait()
+    parsed = urlparse(uri)
+    if parsed.path.endswith('/batch'):
+      self.count('batch')
+      return self.handle_batch(body, headers['content-type'])
+    return self.route(parsed.path, parse_qs(parsed.query), method)
+
+  def route(self, path, query, method):
+    if self.latency_model.fail():
+      self.count('injectedErrors')
+      return self.respond(503, {'error': {'code': 503, 'message': 'Injected'}})
+    match = BACKUP_RUNS_PATTERN.search(path)
+    if match and method == 'POST':
+      self.count('backupRuns.insert')
+      return self.respond(200, {
+        'name': 'op-' + match.group(1),
+        'operationType': 'BACKUP_VOLUME',
+        'targetProject': 'bench',
+        'status': 'PENDING'
+      })
+    if match:
+      self.count('backupRuns.list')
+      return self.respond(200, {'items': [self.backup_run(match.group(1))]})
+    if INSTANCES_PATTERN.search(path):
+      self.count('instances.list')
+      return self.respond(200, self.page(
+        self.instances, query, self.instances_page_size,
+        lambda name: {
+          'name': name,
+          'state': 'RUNNABLE',
+          'settings': {'userLabels': {'env': 'bench'}}
+        }, 'items'
+      ))
+    match = OPERATION_PATTERN.search(path)
+    if match:
+      self.count('operations.get')
+      now = datetime.datetime.utcnow()
+      return self.respond(200, {
+        'name': match.group(1),
+        'status': 'DONE',
+        'startTime': format_time(now - datetime.timedelta(seconds=30)),
+        'endTime': format_time(now)
+      })
+    match = KEYS_PATTERN.search(path)
+    if match:
+      self.count('keys.list')
+      return self.respond(200, self.account_keys(unquote(match.group(1))))
+    if ACCOUNTS_PATTERN.search(path):
+      self.count('serviceAccounts.list')
+      page_size = int(query.get('pageSize', ['100'])[0])
+      return self.respond(200, self.page(
+        self.accounts, query, page_size,
+        lambda email: {'email': email, 'displayName': email.split('@')[0]},
+        'accounts'
+      ))
+    match = POLICY_PATTERN.search(path)
+    if match:
+      self.count('projects.getIamPolicy')
+      return self.respond(200, {
+        'version': 1,
+        'etag': 'BwWbench',
+        'bindings': [{
+          'role': 'roles/iam.serviceAccountKeyAdmin',
+          'members': ['serviceAccount:' + email for email in self.accounts[:3]]
+        }]
+      })
+    if FOLDERS_PATTERN.search(path):
+      self.count('folders.list')
+      return self.respond(200, {'folders': []})
+    if PROJECTS_PATTERN.search(path):
+      self.count('projects.list')
+      return self.respond(200, {
+        'projects': [{'projectId': project} for project in self.projects]
+      })
+    self.count('unknown')
+    return self.respond(404, {'error': {'code': 404, 'message': path}})
+
+  def page(self, items, query, page_size, render, field):
+    start = int(query.get('pageToken', ['0'])[0])
+    end = start + page_size
+    page = {field: [render(item) for item in items[start:end]]}
+    if end < len(items):
+      page['nextPageToken'] = str(end)
+    return page
+
+  def backup_run(self, instance):
+    age = 60 * 24 * 3 if random.random() < self.late_rate else 30
+    end_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=age)
+    return {
+      'id': str(abs(hash(instance))),
+      'status': 'SUCCESSFUL',
+      'endTime': format_time(end_time)
+    }
+
+  def account_keys(self, email):
+    keys = list()
+    for index in range(self.keys_per_account):
+      expired = random.Random(email + str(index)).random() < self.expired_rate
+      age = 400 if expired else 10
+      keys.append({
+        'name': 'projects/bench/serviceAccounts/' + email + '/keys/'
+        + str(index),
+        'keyType': 'USER_MANAGED',
+        'validAfterTime': format_time(
+          self.started - datetime.timedelta(days=age)
+        )
+      })
+    return {'keys': keys}
+
+  def respond(self, status, payload):
+    response = httplib2.Response({
+      'status': str(status),
+      'content-type': 'application/json; charset=UTF-8'
+    })
+    return response, json.dumps(payload).encode('utf-8')
+
+  def handle_batch(self, body, content_type):
+    parser = FeedParser()
+    parser.feed('content-type: ' + content_type + '\r\n\r\n' + body)
+    boundary = 'batch_benchmark_boundary'
+    output = io.StringIO()
+    for part in parser.close().get_payload():
+      request_line = part.get_payload().split('\n', 1)[0].strip()
+      method, target = request_line.split(' ')[:2]
+      parsed = urlparse(target)
+      response, content = self.route(
+        parsed.path, parse_qs(parsed.query), method
+      )
+      output.write(
+        '--' + boundary + '\r\n'
+        'Content-Type: application/http\r\n'
+        'Content-ID: <response-' + part['Content-ID'][1:] + '\r\n\r\n'
+        'HTTP/1.1 ' + str(response.status) + ' OK\r\n'
+        'Content-Type: application/json; charset=UTF-8\r\n\r\n'
+        + content.decode('utf-8') + '\r\n'
+      )
+    output.write('--' + boundary + '--\r\n')
+    response = httplib2.Response({
+      'status': '200',
+      'content-type': 'multipart/mixed; boundary=' + boundary
+    })
+    return response, output.getvalue().encode('utf-8')
+
+
+class FakeSlackAdapter(requests.adapters.BaseAdapter):
+
+  def __init__(self, latency_model, rate_limit_rate=0.0, channels=None):
+    super(FakeSlackAdapter, self).__init__()
+    self.latency_model = latency_model
+    self.rate_limit_rate = rate_limit_rate
+    self.channels = channels or dict()
+    self.calls = collections.Counter()
+    self.messages = list()
+    self.lock = threading.Lock()
+
+  def list_channels(self, token):
+    return [
+      {'name': name, 'id': 'C-' + name}
+      for name in self.channels.get(token, [])
+    ] + [{'name': 'bench', 'id': 'C0'}]
+
+  def record_message(self, token, body):
+    fields = parse_qs(body.decode('utf-8') if isinstance(body, bytes)
+                      else body or str())
+    with self.lock:
+      self.messages.append({
+        'token': token,
+        'channel': fields.get('channel', [None])[0],
+        'text': ' '.join(fields.get('text', []) + fields.get('blocks', []))
+      })
+
+  def send(self, request, **kwargs):
+    self.latency_model.wait()
+    api_method = urlparse(request.url).path.rsplit('/', 1)[-1]
+    token = request.headers.get('Authorization', str())[len('Bearer '):]
+    with self.lock:
+      self.calls[api_method] += 1
+    response = requests.Response()
+    response.request = request
+    response.url = request.url
+    response.headers['Content-Type'] = 'application/json'
+    if self.rate_limit_rate and random.random() < self.rate_limit_rate:
+      response.status_code = 429
+      response.headers['Retry-After'] = '1'
+      payload = {'ok': False, 'error': 'ratelimited'}
+    elif api_method in ('channels.list', 'conversations.list'):
+      response.status_code = 200
+      payload = {'ok': True, 'channels': self.list_channels(token)}
+    else:
+      if api_method == 'chat.postMessage':
+        self.record_message(token, request.body)
+      response.status_code = 200
+      payload = {'ok': True}
+    response._content = json.dumps(payload).encode('utf-8')
+    return response
+
+  def close(self):
+    pass
+
+
+class NullConnection(object):
+
+  def close(self):
+    pass
+
+
+class NullBatch(object):
+
+  def log_struct(self, message, **kwargs):
+    pass
+
+  def commit(self):
+    pass
+
+
+class NullLogger(object):
+
+  def log_struct(self, message, **kwargs):
+    pass
+
+  def batch(self):
+    return NullBatch()
+
+
+class NullLoggingClient(object):
+
+  def __init__(self, *args, **kwargs):
+    pass
+
+  def logger(self, name):
+    return NullLogger()
+
+
+def install(service, backend, slack_adapter):
+  service_dir, module_name = SERVICES[service]
+  os.environ.setdefault('STATE_STORE', 'memory://')
+  google.auth.default = lambda *args, **kwargs: (
+    AnonymousCredentials(), 'bench-project'
+  )
+  google.cloud.logging.Client = NullLoggingClient
+  real_http = httplib2.Http
+
+  class FakeGoogleHttp(real_http):
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+                connection_type=None):
+      self.connections.setdefault(urlparse(uri).netloc, NullConnection())
+      return backend.handle(uri, method, body, headers or dict())
+
+  httplib2.Http = FakeGoogleHttp
+  sys.path.insert(0, os.path.join(REPO_DIR, service_dir))
+  module = importlib.import_module(module_name)
+  module.transport_pool.get_slack_session().mount(
+    'https://slack.com/', slack_adapter
+  )
+  return module
@@ -0,0 +1,13 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_backends
+
+
+module = fake_backends.install(
+  os.environ.get('BENCH_SERVICE', 'db'),
+  fake_backends.FakeGoogleBackend(fake_backends.LatencyModel(0, 0, 0)),
+  fake_backends.FakeSlackAdapter(fake_backends.LatencyModel(0, 0, 0))
+)
+app = module.app
@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_backends
+
+
+def get_slack_target(request_number):
+  suffix = '%03d' % request_number
+  return 'isolation-token-' + suffix, 'isolation-' + suffix, \
+    'isolation-project-' + suffix
+
+
+def build_body(args, request_number):
+  token, channel, project_id = get_slack_target(request_number)
+  body = {
+    'projectID': project_id,
+    'serviceName': 'bench',
+    'region': 'local',
+    'slackToken': token,
+    'slackChannelName': channel,
+    'maxConcurrency': args.max_concurrency,
+    'notificationMode': args.notification_mode
+  }
+  if args.service == 'db':
+    body.update({
+      'requestsPerSecond': 0,
+      'threshold': {},
+      'discover': {'labels': {'env': 'bench'}}
+    })
+  return body
+
+
+def parse_args(argv):
+  parser = argparse.ArgumentParser(
+    description='Send concurrent requests with different Slack tokens and '
+    'channels and check that every message reaches its own token and channel.'
+  )
+  parser.add_argument('service', choices=sorted(fake_backends.SERVICES))
+  parser.add_argument('--requests', type=int, default=40)
+  parser.add_argument('--concurrency', type=int, default=8)
+  parser.add_argument('--items', type=int, default=10,
+                      help='Instances or service accounts, all alerting.')
+  parser.add_argument('--max-concurrency', type=int, default=4)
+  parser.add_argument('--api-latency', type=float, default=0.002)
+  parser.add_argument('--api-jitter', type=float, default=0.002)
+  parser.add_argument('--slack-latency', type=float, default=0.001)
+  parser.add_argument('--notification-mode', default='digest',
+                      choices=['digest', 'immediate'])
+  return parser.parse_args(argv)
+
+
+def run(args):
+  backend = fake_backends.FakeGoogleBackend(
+    fake_backends.LatencyModel(args.api_latency, args.api_jitter, 0),
+    instances=args.items if args.service == 'db' else 0,
+    accounts=args.items if args.service == 'iam' else 0,
+    late_rate=1.0,
+    expired_rate=1.0
+  )
+  targets = dict(
+    get_slack_target(request_number)[:2]
+    for request_number in range(args.requests)
+  )
+  slack_adapter = fake_backends.FakeSlackAdapter(
+    fake_backends.LatencyModel(args.slack_latency, 0, 0),
+    channels=dict((token, [channel]) for token, channel in targets.items())
+  )
+  module = fake_backends.install(args.service, backend, slack_adapter)
+  statuses = list()
+  lock = threading.Lock()
+  next_request = [0]
+
+  def worker():
+    client = module.app.test_client()
+    while True:
+      with lock:
+        request_number = next_request[0]
+        next_request[0] += 1
+      if request_number >= args.requests:
+        return
+      response = client.post('/', json=build_body(args, request_number))
+      with lock:
+        statuses.append(response.status_code)
+
+  threads = [
+    threading.Thread(target=worker) for _ in range(max(1, args.concurrency))
+  ]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  module.slack_dispatcher.drain()
+  return check_messages(args, targets, statuses, slack_adapter.messages)
+
+
+def check_messages(args, targets, statuses, messages):
+  projects = dict(
+    get_slack_target(request_number)[::2]
+    for request_number in range(args.requests)
+  )
+  received, mismatches = set(), list()
+  for message in messages:
+    expected_channel = 'C-' + str(targets.get(message['token']))
+    if message['channel'] != expected_channel:
+      mismatches.append(dict(message, expectedChannel=expected_channel))
+    elif args.notification_mode == 'digest' \
+         and projects.get(message['token']) not in message['text']:
+      mismatches.append(dict(
+        message, expectedProject=projects.get(message['token'])
+      ))
+    received.add(message['token'])
+  return {
+    'service': args.service,
+    'requests': len(statuses),
+    'failedRequests': len([status for status in statuses if status != 200]),
+    'messages': len(messages),
+    'tokensWithoutMessages': sorted(set(targets) - received),
+    'mismatches': mismatches[:10],
+    'mismatchCount': len(mismatches)
+  }
+
+
+def main(argv=None):
+  args = parse_args(argv)
+  report = run(args)
+  print(json.dumps(report, indent=2, sort_keys=True))
+  if report['failedRequests'] or report['mismatchCount'] \
+     or report['tokensWithoutMessages']:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_backends
+
+
+def percentile(values, fraction):
+  if not values:
+    return 0.0
+  ordered = sorted(values)
+  index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+  return ordered[index]
+
+
+def build_body(args, request_number):
+  body = {
+    'projectID': 'bench-project-' + str(request_number),
+    'serviceName': 'bench',
+    'region': 'local',
+    'slackToken': 'bench-token',
+    'slackChannelName': 'bench',
+    'maxConcurrency': args.max_concurrency,
+    'notificationMode': args.notification_mode
+  }
+  if args.service == 'db':
+    body.update({
+      'requestsPerSecond': args.requests_per_second,
+      'threshold': {},
+      'discover': {'labels': {'env': 'bench'}}
+    })
+  else:
+    body.update({
+      'pageSize': args.page_size,
+      'batchSize': args.batch_size
+    })
+  if args.same_project:
+    body['projectID'] = 'bench-project-0'
+  return body
+
+
+def parse_args(argv):
+  parser = argparse.ArgumentParser(
+    description='Run a service against local fakes of Google APIs and Slack.'
+  )
+  parser.add_argument('service', choices=sorted(fake_backends.SERVICES))
+  parser.add_argument('--requests', type=int, default=3)
+  parser.add_argument('--concurrency', type=int, default=1)
+  parser.add_argument('--instances', type=int, default=10000)
+  parser.add_argument('--accounts', type=int, default=50000)
+  parser.add_argument('--keys-per-account', type=int, default=2)
+  parser.add_argument('--api-latency', type=float, default=0.02)
+  parser.add_argument('--api-jitter', type=float, default=0.01)
+  parser.add_argument('--error-rate', type=float, default=0.0)
+  parser.add_argument('--slack-latency', type=float, default=0.05)
+  parser.add_argument('--slack-rate-limit-rate', type=float, default=0.0)
+  parser.add_argument('--late-rate', type=float, default=0.001)
+  parser.add_argument('--expired-rate', type=float, default=0.001)
+  parser.add_argument('--max-concurrency', type=int, default=10)
+  parser.add_argument('--requests-per-second', type=float, default=0)
+  parser.add_argument('--page-size', type=int, default=100)
+  parser.add_argument('--batch-size', type=int, default=50)
+  parser.add_argument('--notification-mode', default='digest',
+                      choices=['digest', 'immediate'])
+  parser.add_argument('--same-project', action='store_true',
+                      help='Reuse one project so state from earlier '
+                      'requests is used.')
+  parser.add_argument('--json', action='store_true',
+                      help='Print the report as JSON.')
+  return parser.parse_args(argv)
+
+
+def run(args):
+  backend = fake_backends.FakeGoogleBackend(
+    fake_backends.LatencyModel(args.api_latency, args.api_jitter,
+                               args.error_rate),
+    instances=args.instances if args.service == 'db' else 0,
+    accounts=args.accounts if args.service == 'iam' else 0,
+    keys_per_account=args.keys_per_account,
+    late_rate=args.late_rate,
+    expired_rate=args.expired_rate
+  )
+  slack_adapter = fake_backends.FakeSlackAdapter(
+    fake_backends.LatencyModel(args.slack_latency, 0, 0),
+    args.slack_rate_limit_rate
+  )
+  module = fake_backends.install(args.service, backend, slack_adapter)
+  latencies, statuses = list(), list()
+  lock = threading.Lock()
+  next_request = [0]
+
+  def worker():
+    client = module.app.test_client()
+    while True:
+      with lock:
+        request_number = next_request[0]
+        next_request[0] += 1
+      if request_number >= args.requests:
+        return
+      started = time.monotonic()
+      response = client.post('/', json=build_body(args, request_number))
+      elapsed = time.monotonic() - started
+      with lock:
+        latencies.append(elapsed)
+        statuses.append(response.status_code)
+
+  started = time.monotonic()
+  threads = [
+    threading.Thread(target=worker) for _ in range(max(1, args.concurrency))
+  ]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  elapsed = time.monotonic() - started
+  drain_started = time.monotonic()
+  module.slack_dispatcher.drain()
+  drain_seconds = time.monotonic() - drain_started
+  google_calls = sum(
+    count for name, count in backend.calls.items() if name != 'batch'
+  )
+  return {
+    'service': args.service,
+    'requests': len(latencies),
+    'failedRequests': len([status for status in statuses if status != 200]),
+    'seconds': round(elapsed, 3),
+    'requestsPerSecond': round(len(latencies) / elapsed, 3),
+    'latencyP50': round(percentile(latencies, 0.50), 3),
+    'latencyP99': round(percentile(latencies, 0.99), 3),
+    'latencyMax': round(max(latencies), 3),
+    'googleCalls': dict(backend.calls),
+    'googleCallsPerSecond': round(google_calls / elapsed, 1),
+    'slackCalls': dict(slack_adapter.calls),
+    'slackDrainSeconds': round(drain_seconds, 3),
+    'slackQueue': module.slack_dispatcher.stats(),
+    'retries': module.retry_counters.stats(),
+    'transport': module.transport_pool.stats()
+  }
+
+
+def print_report(report):
+  print('service              ' + report['service'])
+  print('requests             ' + str(report['requests'])
+        + ' (' + str(report['failedRequests']) + ' failed)')
+  print('duration             ' + str(report['seconds']) + ' s')
+  print('throughput           ' + str(report['requestsPerSecond'])
+        + ' requests/s, ' + str(report['googleCallsPerSecond'])
+        + ' Google API calls/s')
+  print('latency p50/p99/max  ' + str(report['latencyP50']) + ' / '
+        + str(report['latencyP99']) + ' / ' + str(report['latencyMax']) + ' s')
+  print('slack drain          ' + str(report['slackDrainSeconds']) + ' s')
+  for name in ('googleCalls', 'slackCalls', 'slackQueue', 'retries',
+               'transport'):
+    print(name.ljust(21) + json.dumps(report[name], sort_keys=True))
+
+
+def main(argv=None):
+  args = parse_args(argv)
+  report = run(args)
+  if args.json:
+    print(json.dumps(report, indent=2, sort_keys=True))
+  else:
+    print_report(report)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,93 @@
+import argparse
+import datetime
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_backends
+
+
+TIMESTAMP = '2020-06-01T10:20:30.123Z'
+
+
+def legacy_backup_minutes(backup_datetime):
+  strip_datetime = backup_datetime.split('T')
+  backup_time = strip_datetime[1].split('Z')
+  backup_datetime = datetime.datetime.strptime(
+    (strip_datetime[0] + ' ' + backup_time[0]).split('.')[0],
+    '%Y-%m-%d %H:%M:%S'
+  )
+  date_format = '%d-%m-%Y %H:%M:%S'
+  current_time = datetime.datetime.strptime(
+    datetime.datetime.utcnow().strftime(date_format), date_format
+  )
+  backup_datetime = datetime.datetime.strptime(
+    backup_datetime.strftime(date_format), date_format
+  )
+  diff = current_time - backup_datetime
+  return (diff.days * 60 * 24) + (diff.seconds // 60)
+
+
+def report(name, number, seconds):
+  print(name.ljust(40) + ('%.2f' % (seconds / number * 1e6)).rjust(12)
+        + ' us/op  (' + str(number) + ' ops)')
+
+
+def bench_timestamps(number):
+  sys.path.insert(0, os.path.join(fake_backends.REPO_DIR, 'db_backups'))
+  import timestamps
+  report('timestamp legacy strptime round trip', number, timeit.timeit(
+    lambda: legacy_backup_minutes(TIMESTAMP), number=number
+  ))
+  report('timestamp parse_rfc3339 + minutes_since', number, timeit.timeit(
+    lambda: timestamps.minutes_since(timestamps.parse_rfc3339(TIMESTAMP)),
+    number=number
+  ))
+  report('timestamp parse_rfc3339 with offset', number, timeit.timeit(
+    lambda: timestamps.parse_rfc3339('2020-06-01T10:20:30.123+02:00'),
+    number=number
+  ))
+
+
+def bench_iam(accounts, thresholds, number):
+  backend = fake_backends.FakeGoogleBackend(
+    fake_backends.LatencyModel(0, 0, 0), accounts=accounts
+  )
+  module = fake_backends.install(
+    'iam', backend,
+    fake_backends.FakeSlackAdapter(fake_backends.LatencyModel(0, 0, 0))
+  )
+  service_accounts = [
+    {'email': email, 'displayName': email.split('@')[0]}
+    for email in backend.accounts
+  ]
+  data = {
+    'threshold': dict(
+      (email, 30) for email in backend.accounts[:thresholds]
+    ),
+    'exclude': backend.accounts[thresholds:thresholds * 2]
+  }
+  report('get_account_emails ' + str(accounts) + ' accounts', number,
+         timeit.timeit(
+           lambda: module.get_account_emails(None, service_accounts, data),
+           number=number
+         ))
+  report('list_keys_request', number * 100, timeit.timeit(
+    lambda: module.list_keys_request('projects/bench', backend.accounts[0]),
+    number=number * 100
+  ))
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Run micro benchmarks.')
+  parser.add_argument('--number', type=int, default=10000)
+  parser.add_argument('--accounts', type=int, default=10000)
+  parser.add_argument('--thresholds', type=int, default=1000)
+  args = parser.parse_args(argv)
+  bench_timestamps(args.number)
+  bench_iam(args.accounts, args.thresholds, max(1, args.number // 1000))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,78 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_backends
+
+
+ACCOUNT_COUNTS = [1000, 10000]
+ROUNDS = 3
+
+
+def legacy_account_emails(service_accounts, req_service_accounts):
+  account_email = dict()
+  for key, value in req_service_accounts.items():
+    for service_account in service_accounts:
+      if service_account.get('displayName') == key or \
+         service_account.get('email') == key:
+        account_email[service_account.get('email')] = value
+        if value == 'None':
+          account_email[service_account.get('email')] = 90
+        break
+  for service_account in service_accounts:
+    for key in account_email:
+      if service_account.get('displayName') == key or \
+         service_account.get('email') == key:
+        break
+    else:
+      account_email[service_account.get('email')] = 90
+  return account_email
+
+
+@pytest.fixture(scope='module')
+def iam_module():
+  return fake_backends.install(
+    'iam',
+    fake_backends.FakeGoogleBackend(fake_backends.LatencyModel(0, 0, 0)),
+    fake_backends.FakeSlackAdapter(fake_backends.LatencyModel(0, 0, 0))
+  )
+
+
+def build_accounts(count):
+  emails = [
+    'account-' + str(index) + '@bench.iam.gserviceaccount.com'
+    for index in range(count)
+  ]
+  service_accounts = [
+    {'email': email, 'displayName': email.split('@')[0]} for email in emails
+  ]
+  thresholds = dict(
+    (email if index % 2 else email.split('@')[0], 30)
+    for index, email in enumerate(emails[::10])
+  )
+  return service_accounts, thresholds
+
+
+@pytest.mark.parametrize('count', ACCOUNT_COUNTS)
+def test_legacy_account_emails(benchmark, count):
+  service_accounts, thresholds = build_accounts(count)
+  benchmark.extra_info['accounts'] = count
+  benchmark.pedantic(
+    legacy_account_emails, args=(service_accounts, thresholds),
+    rounds=ROUNDS, iterations=1
+  )
+
+
+@pytest.mark.parametrize('count', ACCOUNT_COUNTS)
+def test_get_account_emails(benchmark, iam_module, count):
+  service_accounts, thresholds = build_accounts(count)
+  benchmark.extra_info['accounts'] = count
+  account_email, found_names = benchmark.pedantic(
+    iam_module.get_account_emails,
+    args=(None, service_accounts, {'threshold': thresholds}),
+    rounds=ROUNDS, iterations=1
+  )
+  assert len(found_names) == len(thresholds)
+  assert account_email == legacy_account_emails(service_accounts, thresholds)
@@ -0,0 +1,96 @@
+import datetime
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_backends
+from micro_benchmarks import legacy_backup_minutes
+
+sys.path.insert(0, os.path.join(fake_backends.REPO_DIR, 'db_backups'))
+import timestamps
+
+
+TIMESTAMP_COUNT = 100000
+ROUNDS = 3
+
+
+def build_timestamps(count, seed=0):
+  generator = random.Random(seed)
+  start = datetime.datetime(2020, 1, 1, tzinfo=timestamps.UTC)
+  values = list()
+  for index in range(count):
+    moment = start + datetime.timedelta(
+      seconds=generator.randrange(3 * 365 * 86400),
+      microseconds=generator.randrange(1000000)
+    )
+    if index % 10 == 9:
+      values.append(moment.strftime('%Y-%m-%dT%H:%M:%S+00:00'))
+    elif index % 2:
+      values.append(moment.strftime('%Y-%m-%dT%H:%M:%SZ'))
+    else:
+      values.append(moment.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z')
+  return values
+
+
+TIMESTAMPS = build_timestamps(TIMESTAMP_COUNT)
+GOOGLE_TIMESTAMPS = [value for value in TIMESTAMPS if value[-1] == 'Z']
+
+
+def legacy_key_days(value):
+  date_format = '%d-%m-%Y'
+  key_date = datetime.datetime.strptime(
+    datetime.datetime.strptime(value[:10], '%Y-%m-%d').strftime(date_format),
+    date_format
+  )
+  current_date = datetime.datetime.strptime(
+    datetime.datetime.utcnow().strftime(date_format), date_format
+  )
+  return (current_date - key_date).days
+
+
+def run_benchmark(benchmark, function, values):
+  result = benchmark.pedantic(
+    lambda: [function(value) for value in values], rounds=ROUNDS, iterations=1
+  )
+  benchmark.extra_info['timestamps'] = len(values)
+  if benchmark.stats is not None:
+    benchmark.extra_info['microsecondsPerTimestamp'] = round(
+      benchmark.stats.stats.mean / len(values) * 1e6, 3
+    )
+  return result
+
+
+def test_legacy_backup_minutes(benchmark):
+  run_benchmark(benchmark, legacy_backup_minutes, GOOGLE_TIMESTAMPS)
+
+
+def test_parse_rfc3339_minutes_since(benchmark):
+  now = timestamps.utcnow()
+  minutes = run_benchmark(
+    benchmark,
+    lambda value: timestamps.minutes_since(
+      timestamps.parse_rfc3339(value), now
+    ),
+    GOOGLE_TIMESTAMPS
+  )
+  assert abs(minutes[0] - legacy_backup_minutes(GOOGLE_TIMESTAMPS[0])) <= 1
+
+
+def test_parse_rfc3339_mixed_formats(benchmark):
+  parsed = run_benchmark(benchmark, timestamps.parse_rfc3339, TIMESTAMPS)
+  assert all(value.tzinfo is not None for value in parsed)
+
+
+def test_legacy_key_days(benchmark):
+  run_benchmark(benchmark, legacy_key_days, TIMESTAMPS)
+
+
+def test_parse_rfc3339_days_since(benchmark):
+  now = timestamps.utcnow()
+  days = run_benchmark(
+    benchmark,
+    lambda value: timestamps.days_since(timestamps.parse_rfc3339(value), now),
+    TIMESTAMPS
+  )
+  assert days[0] == legacy_key_days(TIMESTAMPS[0])
@@ -1,81 +1,228 @@
-from flask import Flask, jsonify, request
+import time
+load_started = time.monotonic()
+
+from flask import Flask, g, jsonify, request, stream_with_context
 from google.cloud import logging
 from google.cloud.logging.resource import Resource
-from googleapiclient import discovery
 from googleapiclient.errors import HttpError
 from werkzeug.exceptions import BadRequest
-from datetime import datetime as date
-import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import copy
+import heapq
 import os
+import re
 import sys
-import time
+import threading
+import uuid
 import pytz
 import json
-import tenacity
-from slackclient import SlackClient
+from alert_dedupe import AlertDeduper
+from backup_scheduler import DeadlineScheduler, ScheduleLease
+from log_sink import LogSink
+import metrics
+from retry_policy import RetryBudget, api_retry, is_retryable, retry_counters
+from slack_cache import channel_cache
+from slack_digest import SlackDigest, section_block
+from shard_dispatch import (read_shard_body, shard_dispatcher_from_env,
+                            split_shards)
+from slack_dispatcher import SlackDispatcher
+from state_store import state_store_from_env
+from status_cache import StatusCache
+from timestamps import minutes_since, parse_rfc3339
+from transport import TransportPool
 
 
 app = Flask(__name__)
-service = discovery.build('sqladmin', 'v1beta4', cache_discovery=True)
-channel_name, project_id, service_name, region = str(), str(), str(), str()
-slack_client, cloud_run_resource = None, None
-logger = logging.Client().logger('Cloud-Run-Log')
+transport_pool = TransportPool.from_env()
+log_sink = LogSink.from_env(
+  logging.Client().logger('Cloud-Run-Log'),
+  metrics.logging_write_seconds.observe
+)
+instances_checked = metrics.Counter(
+  'sql_instances_checked', 'SQL instances checked for backups, by result.',
+  ['result']
+)
+backups_started = metrics.Counter(
+  'sql_backups_started', 'SQL instance backups started.'
+)
+run_state_store = state_store_from_env()
+alert_deduper = AlertDeduper(run_state_store)
+status_cache = StatusCache.from_env(run_state_store)
+DEFAULT_MAX_CONCURRENCY = 10
+DEFAULT_REQUESTS_PER_SECOND = 5
+RATE_LIMIT_BACKOFF_SECONDS = 10
+DEFAULT_OPERATION_TIMEOUT = 0
+OPERATION_POLL_INITIAL_DELAY = 2
+OPERATION_POLL_MAX_DELAY = 30
+DEFAULT_RECHECK_INTERVAL = 300
+DEFAULT_RENOTIFY_MINUTES = 1440
+SLACK_REQUEST_TIMEOUT = 10
+DEFAULT_DISCOVERY_THRESHOLD = 1440
+DEFAULT_DISCOVERY_CACHE_MINUTES = 60
+DEFAULT_RETRY_BUDGET = 20
+DEFAULT_RETRY_BUDGET_PER_ITEM = 0.1
+MAX_REPORTED_UNCHECKED = 20
+DEFAULT_SHARD_SIZE = 50
+STATUS_REQUESTS_PER_SECOND = 2
+STATUS_MAX_CONCURRENCY = 4
+SCHEDULE_STATE_KEY = 'schedule'
+DEFAULT_SCHEDULE_LEASE_SECONDS = 60
+SCHEDULE_FIELDS = (
+  'projectID', 'serviceName', 'region', 'slackChannelName', 'threshold',
+  'discover', 'backupLeadMinutes', 'recheckInterval', 'renotifyMinutes',
+  'requestsPerSecond', 'retryBudget', 'notificationMode'
+)
+
+
+class ApiPacer(object):
+
+  def __init__(self, requests_per_second):
+    self.interval = 1.0 / requests_per_second if requests_per_second else 0
+    self.next_slot = time.monotonic()
+    self.lock = threading.Lock()
+
+  def wait(self):
+    with self.lock:
+      now = time.monotonic()
+      slot = max(now, self.next_slot)
+      self.next_slot = slot + self.interval
+    if slot > now:
+      time.sleep(slot - now)
+
+  def backoff(self, seconds):
+    with self.lock:
+      self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+class SlackDeliveryError(Exception):
+  pass
+
+
+class RequestContext(object):
+
+  def __init__(self, project_id, service_name, region, channel_name,
+               slack_token):
+    self.project_id = project_id
+    self.service_name = service_name
+    self.region = region
+    self.channel_name = channel_name
+    self.slack_token, self.slack_client = None, None
+    if slack_token is not None:
+      self.slack_token = str(slack_token)
+      self.slack_client = transport_pool.get_slack_client(self.slack_token)
+    self.cloud_run_resource = Resource(
+      type='cloud_run_revision',
+      labels={
+        'project_id': project_id,
+        'service_name': service_name,
+        'region': region
+      }
+    )
+    self.api_pacer = None
+    self.recheck_interval = DEFAULT_RECHECK_INTERVAL
+    self.renotify_interval = DEFAULT_RENOTIFY_MINUTES * 60
+    self.notification_digest = None
+    self.backup_operations = dict()
+    self.retry_budget = RetryBudget(DEFAULT_RETRY_BUDGET)
+
+
+def get_service():
+  return transport_pool.build('sqladmin', 'v1beta4')
+
 
-def set_token(token):
-  global slack_client
-  slack_client = SlackClient(str(token))
+def execute_request(api_request):
+  method = metrics.get_method(api_request)
+  with metrics.google_api_seconds.labels(method=method).time(), \
+      transport_pool.http() as http:
+    return api_request.execute(http=http)
 
 
-def list_channels():
-  channels_call = slack_client.api_call('channels.list')
+def list_channels(context):
+  with metrics.slack_api_seconds.labels(method='channels.list').time():
+    channels_call = context.slack_client.api_call(
+      'channels.list', timeout=SLACK_REQUEST_TIMEOUT
+    )
   if channels_call['ok']:
     return channels_call['channels']
   return None
 
 
-def log_to_stackdriver(message, log_level):
-  logger.log_struct(
-    message,
-    resource=cloud_run_resource,
-    severity=log_level
-  )
+def log_to_stackdriver(context, message, log_level):
+  resource = None
+  if context is not None:
+    resource = context.cloud_run_resource
+  log_sink.log_struct(message, resource, log_level)
+
+
+@app.before_request
+def start_request_timer():
+  g.request_started = time.monotonic()
 
 
-def send_message(channel_id, message):
+@app.after_request
+def observe_request(response):
+  if 'request_started' in g:
+    metrics.request_seconds.labels(
+      endpoint=str(request.endpoint), status=str(response.status_code)
+    ).observe(time.monotonic() - g.request_started)
+  return response
+
+
+@app.teardown_request
+def flush_logs(exception):
+  # Status, stats and metrics reads write no logs, don't wait for the sink.
+  if request.method != 'GET':
+    log_sink.flush()
+
+
+def send_message(context, channel_id, blocks):
   log_to_stackdriver(
+    context,
     {
       "message": "Making slack api call.",
       "functionName": "send_message"
     },
     'INFO'
   )
-  slack_client.api_call(
-    'chat.postMessage',
-    channel=channel_id,
-    blocks=[{
-      'type': 'section',
-      'text': {
-        'type': 'mrkdwn',
-        'text': message
-      }
-    }]
-  )
+  with metrics.slack_api_seconds.labels(method='chat.postMessage').time():
+    return context.slack_client.api_call(
+      'chat.postMessage',
+      timeout=SLACK_REQUEST_TIMEOUT,
+      channel=channel_id,
+      blocks=blocks
+    )
 
 
-def check_diff_time(backup_datetime):
-  current_utc = date.utcnow()
-  current_time = current_utc.strftime('%d-%m-%Y %H:%M:%S')
-  backup_datetime = backup_datetime.strftime('%d-%m-%Y %H:%M:%S')
-  date_format = '%d-%m-%Y %H:%M:%S'
-  current_time = date.strptime(current_time, date_format)
-  backup_datetime = date.strptime(backup_datetime, date_format)
-  diff = current_time - backup_datetime
-  backup_minutes = (diff.days * 60 * 24) + (diff.seconds // 60)
-  return backup_minutes
+def notify_alert(context, subject, alert_type, state, message):
+  notify, escalated = alert_deduper.check(
+    context.project_id, subject, alert_type, state,
+    context.renotify_interval
+  )
+  if not notify:
+    log_to_stackdriver(
+      context,
+      {
+        "message": "Alert already sent, skipping.",
+        "subject": str(subject),
+        "alertType": alert_type,
+        "functionName": "notify_alert"
+      },
+      'INFO'
+    )
+    return
+  if escalated:
+    message = 'Escalation: ' + message
+  send_msg_to_slack(
+    context, message,
+    lambda: alert_deduper.release(
+      context.project_id, subject, alert_type, state
+    )
+  )
 
 
-def compare_threshold(instance, backup_mint, threshold_min):
+def compare_threshold(context, instance, backup_mint, threshold_min):
   log_to_stackdriver(
+    context,
     {
       "message": "Comparing threshold of instance.",
       "instanceName": str(instance),
@@ -86,7 +233,9 @@ def compare_threshold(instance, backup_mint, threshold_min):
     'INFO'
   )
   if backup_mint > threshold_min:
-    send_msg_to_slack(
+    notify_alert(
+      context, instance, 'backup_late',
+      backup_mint // max(1, threshold_min),
       'Backup of instance is not taken \n `Instance Name: '
       + str(instance) + '` \n `Threshold in minutes: ' +
       str(threshold_min) + '` \n `Time since last backup taken in minutes: '
@@ -94,14 +243,9 @@ def compare_threshold(instance, backup_mint, threshold_min):
     )
 
 
-@tenacity.retry(
-  wait=tenacity.wait_fixed(5),
-  stop=tenacity.stop_after_attempt(3),
-  retry=tenacity.retry_if_exception_type(ConnectionResetError) | 
-  tenacity.retry_if_exception_type(BrokenPipeError) |
-  tenacity.retry_if_exception_type(IOError))
-def take_backup(instance):
+def take_backup(context, instance):
   log_to_stackdriver(
+    context,
     {
       "message": "Taking backup of instance.",
       "instanceName": str(instance),
@@ -109,41 +253,181 @@ def take_backup(instance):
     },
     'INFO'
   )
-  insert_response = service.backupRuns().insert(
-    project=project_id,
-    instance=instance,
-    body={}
-  ).execute(num_retries=2)
-  time.sleep(3)
+  insert_response = insert_backup_run(context, instance)
   for key, value in insert_response.items():
     if key == 'operationType':
       operationType = value
     elif key == 'targetProject':
       targetProject = value
+  context.backup_operations[instance] = insert_response.get('name')
+  backups_started.inc()
   send_msg_to_slack(
+    context,
     'SQL instance backup processes initiated for: \n `Instance Name : '
     + str(instance) + '` \n `OperationType: ' + str(operationType) +
     '` \n `Project: ' + str(targetProject) + '`'
   )
+  return 'started'
+
+
+def report_unknown_backup(context, instance):
+  send_msg_to_slack(
+    context,
+    'SQL instance backup may have been started, the request failed after it '
+    'was sent. Check the backup runs of: \n `Instance Name : '
+    + str(instance) + '`'
+  )
+
+
+@api_retry(idempotent=False)
+def insert_backup_run(context, instance):
+  context.api_pacer.wait()
+  return execute_request(get_service().backupRuns().insert(
+    project=context.project_id,
+    instance=instance,
+    body={}
+  ))
 
 
-def get_backup_time(backup_datetime):
-  strip_datetime = backup_datetime.split('T')
-  backup_time = strip_datetime[1]
-  backup_time = backup_time.split('Z')
-  backup_datetime = strip_datetime[0] + ' ' + backup_time[0]
-  backup_datetime = datetime.datetime.strptime(backup_datetime.split(".")[0], '%Y-%m-%d  %H:%M:%S')
-  return backup_datetime
+@api_retry()
+def get_operation(context, operation):
+  context.api_pacer.wait()
+  return execute_request(get_service().operations().get(
+    project=context.project_id,
+    operation=operation
+  ))
 
 
-@tenacity.retry(
-  wait=tenacity.wait_fixed(5),
-  stop=tenacity.stop_after_attempt(3),
-  retry=tenacity.retry_if_exception_type(ConnectionResetError) | 
-  tenacity.retry_if_exception_type(BrokenPipeError) |
-  tenacity.retry_if_exception_type(IOError))
-def get_backup(instance, threshold_min, check_only):
+def get_operation_outcome(operation, operation_response):
+  outcome = {
+    'operation': operation,
+    'status': operation_response.get('status')
+  }
+  errors = operation_response.get('error', {}).get('errors', [])
+  if operation_response.get('status') == 'DONE':
+    outcome['status'] = 'FAILED' if errors else 'SUCCESSFUL'
+  if errors:
+    outcome['error'] = '; '.join(
+      str(error.get('message') or error.get('code')) for error in errors
+    )
+  if operation_response.get('startTime') and operation_response.get('endTime'):
+    duration = parse_rfc3339(operation_response.get('endTime')) \
+      - parse_rfc3339(operation_response.get('startTime'))
+    outcome['durationSeconds'] = duration.total_seconds()
+  return outcome
+
+
+def track_operations(context, operations, timeout):
   log_to_stackdriver(
+    context,
+    {
+      "message": "Tracking backup operations.",
+      "operationCount": str(len(operations)),
+      "functionName": "track_operations"
+    },
+    'INFO'
+  )
+  deadline = time.monotonic() + timeout
+  outcomes = dict(
+    (instance, {'operation': operation, 'status': 'PENDING'})
+    for instance, operation in operations.items()
+  )
+  polls = [
+    (time.monotonic(), instance, OPERATION_POLL_INITIAL_DELAY)
+    for instance in operations
+  ]
+  heapq.heapify(polls)
+  while polls:
+    next_poll, instance, delay = heapq.heappop(polls)
+    if next_poll > deadline:
+      outcomes[instance]['lastStatus'] = outcomes[instance]['status']
+      outcomes[instance]['status'] = 'TIMEOUT'
+      continue
+    time.sleep(max(0, next_poll - time.monotonic()))
+    try:
+      operation_response = get_operation(context, operations[instance])
+    except HttpError as err:
+      outcomes[instance]['status'] = 'UNKNOWN'
+      outcomes[instance]['error'] = str(err)
+      continue
+    outcomes[instance] = get_operation_outcome(
+      operations[instance], operation_response
+    )
+    if operation_response.get('status') != 'DONE':
+      heapq.heappush(polls, (
+        time.monotonic() + delay, instance,
+        min(delay * 2, OPERATION_POLL_MAX_DELAY)
+      ))
+  for instance, outcome in outcomes.items():
+    if outcome['status'] == 'FAILED':
+      send_msg_to_slack(
+        context,
+        'SQL instance backup failed for: \n `Instance Name: '
+        + str(instance) + '` \n `Error: ' + str(outcome.get('error')) + '`'
+      )
+  return outcomes
+
+
+def get_state_key(context, instance, check_only):
+  return '/'.join([
+    str(context.project_id), str(instance),
+    'status' if check_only else 'threshold'
+  ])
+
+
+def is_check_due(state, threshold_min, lead_seconds=0):
+  if state is None:
+    return True
+  if state.get('thresholdMinutes') != str(threshold_min):
+    return True
+  return time.time() >= state.get('nextCheckAt', 0) - lead_seconds
+
+
+@api_retry()
+def list_backup_runs(context, instance):
+  context.api_pacer.wait()
+  return execute_request(get_service().backupRuns().list(
+    project=context.project_id,
+    instance=instance, maxResults=1
+  ))
+
+
+def get_status_entry(backup, threshold_min):
+  entry = {
+    'backupId': backup.get('id'),
+    'status': backup.get('status'),
+    'endTime': backup.get('endTime'),
+    'checkedAt': time.time()
+  }
+  if backup.get('endTime'):
+    entry['minutesSinceBackup'] = int(
+      minutes_since(parse_rfc3339(str(backup.get('endTime'))))
+    )
+  if threshold_min is not None:
+    entry['thresholdMinutes'] = int(threshold_min)
+    entry['late'] = entry.get('minutesSinceBackup', 0) > int(threshold_min)
+  return entry
+
+
+def get_backup(context, instance, threshold_min, check_only, lead_seconds=0):
+  state_key = get_state_key(context, instance, check_only)
+  state = run_state_store.get(state_key)
+  if not is_check_due(state, threshold_min, lead_seconds):
+    instances_checked.labels(result='skipped').inc()
+    log_to_stackdriver(
+      context,
+      {
+        "message": "Skipping instance, next check is not due.",
+        "instanceName": str(instance),
+        "nextCheckAt": str(state.get('nextCheckAt')),
+        "functionName": "get_backup"
+      },
+      'INFO'
+    )
+    return 'skipped'
+  state = state or dict()
+  log_to_stackdriver(
+    context,
     {
       "message": "Getting last backup of instance.",
       "instanceName": str(instance),
@@ -151,89 +435,192 @@ def get_backup(instance, threshold_min, check_only):
     },
     'INFO'
   )
-  backup_list = service.backupRuns().list(
-    project=project_id,
-    instance=instance, maxResults=1
-  ).execute(num_retries=2)
-  for key, value in backup_list.items():
-    if key == 'items':
-      for key1, value1 in value[0].items():
-        if (key1 == 'status' and value1 != 'RUNNING'):
-          if check_only:
-            log_to_stackdriver(
-              {
-                "message": "Checking backup status.",
-                "instanceName": str(instance),
-                "backupStatus": str(value1),
-                "functionName": "get_backup"
-              },
-              'INFO'
-            )
-            if value[0].get('status') != 'SUCCESSFUL':
-              send_msg_to_slack(
-                'Last backup details: \n `Instance name: '
-                + str(instance) + '` \n `Backup id: ' + str(value[0].get('id'))
-                + '` \n `Backup Status: ' + str(value[0].get('status')) + '`'
-              )
-          else:
-            backup_datetime = get_backup_time(
-              str(value[0].get('endTime'))
-            )
-            backup_mint = check_diff_time(backup_datetime)
-            compare_threshold(instance, int(backup_mint), int(threshold_min))
-            time.sleep(1)
-
-
-def send_msg_to_slack(message):
+  backup_list = list_backup_runs(context, instance)
+  instances_checked.labels(result='checked').inc()
+  items = backup_list.get('items')
+  if not items or items[0].get('status') == 'RUNNING':
+    return 'pending'
+  backup = items[0]
+  status_cache.update(
+    context.project_id, instance,
+    get_status_entry(backup, None if check_only else threshold_min)
+  )
+  new_state = {
+    'backupId': backup.get('id'),
+    'endTime': backup.get('endTime'),
+    'status': backup.get('status'),
+    'thresholdMinutes': str(threshold_min),
+    'alerted': False,
+    'nextCheckAt': 0
+  }
+  if check_only:
+    log_to_stackdriver(
+      context,
+      {
+        "message": "Checking backup status.",
+        "instanceName": str(instance),
+        "backupStatus": str(backup.get('status')),
+        "functionName": "get_backup"
+      },
+      'INFO'
+    )
+    if backup.get('status') != 'SUCCESSFUL':
+      notify_alert(
+        context, instance, 'backup_status',
+        str(backup.get('id')) + ':' + str(backup.get('status')),
+        'Last backup details: \n `Instance name: '
+        + str(instance) + '` \n `Backup id: ' + str(backup.get('id'))
+        + '` \n `Backup Status: ' + str(backup.get('status')) + '`'
+      )
+      new_state['alerted'] = True
+    else:
+      if state.get('alerted'):
+        alert_deduper.resolve(context.project_id, instance, 'backup_status')
+      new_state['nextCheckAt'] = time.time() + context.recheck_interval
+  else:
+    backup_datetime = parse_rfc3339(str(backup.get('endTime')))
+    backup_mint = minutes_since(backup_datetime)
+    compare_threshold(
+      context, instance, int(backup_mint), int(threshold_min)
+    )
+    if backup_mint > int(threshold_min):
+      new_state['alerted'] = True
+    else:
+      if state.get('alerted'):
+        alert_deduper.resolve(context.project_id, instance, 'backup_late')
+      new_state['nextCheckAt'] = backup_datetime.timestamp() \
+        + int(threshold_min) * 60
+  run_state_store.put(state_key, new_state)
+  if new_state['alerted']:
+    return 'alerted'
+  if lead_seconds and time.time() >= new_state['nextCheckAt'] - lead_seconds:
+    return 'due'
+  return 'ok'
+
+
+def send_msg_to_slack(context, message, on_failure=None):
   log_to_stackdriver(
+    context,
     {
       "message": "Sending message to slack.",
       "functionName": "send_msg_to_slack"  
     },
     'INFO'
   )
-  channels = list_channels()
-  if channels:
-    for channel in channels:
-      if channel['name'] == channel_name:
-        send_message(channel['id'], message)
+  if context is None or context.slack_client is None:
+    return
+  if context.notification_digest is not None:
+    context.notification_digest.add(message, on_failure)
+    return
+  send_blocks_to_slack(
+    context, [section_block(message)],
+    [on_failure] if on_failure is not None else []
+  )
+
+
+def send_blocks_to_slack(context, blocks, failure_callbacks=()):
+
+  def report_failure():
+    for on_failure in failure_callbacks:
+      on_failure()
+
+  if not slack_dispatcher.submit(
+      (context.slack_token, context.channel_name),
+      lambda: deliver_blocks(context, blocks), report_failure):
+    report_failure()
+    log_to_stackdriver(
+      context,
+      {
+        "message": "Slack queue is full, message dropped.",
+        "functionName": "send_blocks_to_slack"
+      },
+      'WARNING'
+    )
+
+
+def deliver_blocks(context, blocks):
+  channel_id = channel_cache.get_channel_id(
+    context.slack_token, context.channel_name,
+    lambda: list_channels(context)
+  )
+  if not channel_id:
+    raise SlackDeliveryError(
+      'Slack channel not found: ' + str(context.channel_name)
+    )
+  response = send_message(context, channel_id, blocks)
+  if response and response.get('error') == 'channel_not_found':
+    channel_cache.invalidate(context.slack_token, context.channel_name)
+    channel_id = channel_cache.get_channel_id(
+      context.slack_token, context.channel_name,
+      lambda: list_channels(context)
+    )
+    if channel_id:
+      response = send_message(context, channel_id, blocks)
+  if response and not response.get('ok') \
+     and response.get('error') != 'ratelimited':
+    raise SlackDeliveryError('Slack error: ' + str(response.get('error')))
+  return response
+
+
+def report_slack_failure(channel_key, outcome, reason):
+  log_to_stackdriver(
+    None,
+    {
+      "message": "Slack message was not delivered.",
+      "slackChannelName": str(channel_key[1]),
+      "outcome": outcome,
+      "error": reason,
+      "functionName": "report_slack_failure"
+    },
+    'ERROR'
+  )
+
+
+slack_dispatcher = SlackDispatcher.from_env(report_slack_failure)
+shard_dispatcher = shard_dispatcher_from_env(
+  lambda body: app.test_client().post('/shardWorker', json=body)
+)
+
+
+def start_notifications(context, notification_mode, title):
+  context.notification_digest = None
+  if notification_mode == 'digest':
+    context.notification_digest = SlackDigest(title)
+
+
+def flush_notifications(context):
+  digest, context.notification_digest = context.notification_digest, None
+  if digest is not None:
+    for blocks, failure_callbacks in digest.build_deliveries():
+      send_blocks_to_slack(context, blocks, failure_callbacks)
 
 
 def set_metadata(req_channel_name, req_project_id, req_service_name, 
                  req_region, req_slack_token):
-  global channel_name, project_id, service_name, region
-  project_id = req_project_id
-  service_name = req_service_name
-  region = req_region
-  channel_name = req_channel_name
-  if project_id is None:
-    return True, jsonify({"error": str('Please provide projectID')}), 403
-  elif service_name is None:
-    return True, jsonify({"error": str('Please provide serviceName')}), 403
-  elif region is None:
-    return True, jsonify({"error": str('Please provide region')}), 403
-  elif channel_name is None:
-    return True, jsonify({"error": str('Please provide slackChannelName')}), 
-    403
+  if req_project_id is None:
+    return None, jsonify({"error": str('Please provide projectID')}), 403
+  elif req_service_name is None:
+    return None, jsonify({"error": str('Please provide serviceName')}), 403
+  elif req_region is None:
+    return None, jsonify({"error": str('Please provide region')}), 403
+  elif req_channel_name is None:
+    return None, jsonify({"error": str('Please provide slackChannelName')}), \
+      403
   elif req_slack_token is None:
-    return True, jsonify({"error": str('Please provide slackToken')}), 403
+    return None, jsonify({"error": str('Please provide slackToken')}), 403
   else:
-    set_token(req_slack_token)
-    global cloud_run_resource
-    cloud_run_resource = Resource(
-      type='cloud_run_revision',
-      labels={
-        'project_id': project_id,
-        'service_name': service_name,
-        'region': region
-      }
+    context = RequestContext(
+      req_project_id, req_service_name, req_region, req_channel_name,
+      req_slack_token
     )
-    return False, str(), 0
+    return context, str(), 0
 
 
-def catch_error(error_type, err, instance):
+def catch_error(context, error_type, err, instance):
+  metrics.errors.labels(category=error_type).inc()
   exc_type, exc_obj, exc_tb = sys.exc_info()
   log_to_stackdriver(
+    context,
     {
       "message": str(err),
       "codeLineNo": str(exc_tb.tb_lineno) 
@@ -246,10 +633,11 @@ def catch_error(error_type, err, instance):
         reason = 'Operation failed because another backup ' \
           'operation was already in progress for \n `Instance Name:' \
           + str(instance) + '`'
-        send_msg_to_slack(reason)
+        send_msg_to_slack(context, reason)
         return jsonify({"error": str(err)}), 409
     elif err.resp.status == 403:
-      send_msg_to_slack(
+      notify_alert(
+        context, instance, 'instance_forbidden', err.resp.status,
         'Error: Invalid request. please check if the instance `'
         + str(instance) + '` exist or not.'
       )
@@ -258,86 +646,820 @@ def catch_error(error_type, err, instance):
       return jsonify({"error": str(err)}), 404
   elif error_type == 'BadRequest':
     send_msg_to_slack(
+      context,
       'Invalid request: Please check your document syntex'
     )
     return jsonify({"error": str(err)}), 400
   elif error_type == 'Exception':
-    send_msg_to_slack('Error: ' + str(err))
+    send_msg_to_slack(context, 'Error: ' + str(err))
     return jsonify ({"error": str(err)}), 417
   else:
     return jsonify({"error": str(err)}), 404
 
 
-@tenacity.retry(
-  wait=tenacity.wait_fixed(5),
-  stop=tenacity.stop_after_attempt(3),
-  retry=tenacity.retry_if_exception_type(ConnectionResetError) | 
-  tenacity.retry_if_exception_type(BrokenPipeError) |
-  tenacity.retry_if_exception_type(IOError))
+@api_retry()
+def get_instances_page(context, api_request):
+  context.api_pacer.wait()
+  return execute_request(api_request)
+
+
+def list_instances(context):
+  log_to_stackdriver(
+    context,
+    {
+      "message": "Listing SQL instances.",
+      "functionName": "list_instances"
+    },
+    'INFO'
+  )
+  instances = get_service().instances()
+  api_request = instances.list(project=context.project_id)
+  while api_request is not None:
+    response = get_instances_page(context, api_request)
+    for instance in response.get('items', []):
+      yield {
+        'name': instance.get('name'),
+        'state': instance.get('state'),
+        'labels': instance.get('settings', {}).get('userLabels', {})
+      }
+    api_request = instances.list_next(api_request, response)
+
+
+def get_inventory(context, cache_minutes):
+  inventory_key = 'inventory/' + str(context.project_id)
+  inventory = run_state_store.get(inventory_key)
+  if inventory is None \
+     or time.time() - inventory.get('listedAt', 0) >= cache_minutes * 60:
+    inventory = {
+      'instances': list(list_instances(context)),
+      'listedAt': time.time()
+    }
+    run_state_store.put(inventory_key, inventory)
+  return inventory['instances']
+
+
+def discover_instances(context, discover):
+  name_pattern = re.compile(discover.get('namePattern') or '')
+  labels = dict(
+    (key, value if isinstance(value, str) else json.dumps(value))
+    for key, value in (discover.get('labels') or dict()).items()
+  )
+  states = discover.get('states') or ['RUNNABLE']
+  try:
+    inventory = get_inventory(
+      context,
+      float(discover.get('cacheMinutes', DEFAULT_DISCOVERY_CACHE_MINUTES))
+    )
+  except HttpError as err:
+    log_to_stackdriver(
+      context,
+      {
+        "message": str(err),
+        "functionName": "discover_instances"
+      },
+      'ERROR'
+    )
+    return list()
+  return [
+    instance['name'] for instance in inventory
+    if instance['state'] in states
+    and name_pattern.search(instance['name'])
+    and all(
+      instance['labels'].get(key) == value
+      for key, value in labels.items()
+    )
+  ]
+
+
+def set_request_options(context, data):
+  context.api_pacer = ApiPacer(
+    float(data.get('requestsPerSecond', DEFAULT_REQUESTS_PER_SECOND))
+  )
+  context.recheck_interval = float(
+    data.get('recheckInterval', DEFAULT_RECHECK_INTERVAL)
+  )
+  context.renotify_interval = float(
+    data.get('renotifyMinutes', DEFAULT_RENOTIFY_MINUTES)
+  ) * 60
+  context.retry_budget = RetryBudget(
+    data.get('retryBudget', DEFAULT_RETRY_BUDGET),
+    data.get('retryBudgetPerItem', DEFAULT_RETRY_BUDGET_PER_ITEM)
+  )
+
+
+def get_instance_status(context, instance):
+  try:
+    items = list_backup_runs(context, instance).get('items')
+  except HttpError as err:
+    return {'error': str(err), 'checkedAt': time.time()}
+  if not items:
+    return {'status': None, 'checkedAt': time.time()}
+  state = run_state_store.get(get_state_key(context, instance, False))
+  threshold_min = None
+  if state is not None and state.get('thresholdMinutes') is not None:
+    threshold_min = state.get('thresholdMinutes')
+  return get_status_entry(items[0], threshold_min)
+
+
+def refresh_project_status(project_id):
+  context = RequestContext(
+    project_id, os.environ.get('K_SERVICE', 'status-refresher'),
+    os.environ.get('STATUS_REGION', str()), None, None
+  )
+  set_request_options(
+    context, {'requestsPerSecond': STATUS_REQUESTS_PER_SECOND}
+  )
+  instances = [
+    instance['name'] for instance in get_inventory(
+      context, DEFAULT_DISCOVERY_CACHE_MINUTES
+    ) if instance['state'] == 'RUNNABLE'
+  ]
+  with ThreadPoolExecutor(max_workers=STATUS_MAX_CONCURRENCY) as executor:
+    statuses = executor.map(
+      lambda instance: get_instance_status(context, instance), instances
+    )
+    return dict(zip(instances, statuses))
+
+
+def report_status_failure(project_id, err):
+  log_to_stackdriver(
+    None,
+    {
+      "message": str(err),
+      "projectID": str(project_id),
+      "functionName": "refresh_project_status"
+    },
+    'ERROR'
+  )
+
+
+def run_instance_task(context, task, instance, *args):
+  record = {
+    'type': 'instance',
+    'instance': instance,
+    'task': task.__name__
+  }
+  started = time.monotonic()
+  with app.app_context():
+    try:
+      record['result'] = task(context, instance, *args)
+    except HttpError as err:
+      if err.resp.status == 429:
+        context.api_pacer.backoff(RATE_LIMIT_BACKOFF_SECONDS)
+      error, err_code = catch_error(context, 'HttpError', err, str(instance))
+      record['result'] = 'error'
+      # A failed insert may still have started the backup, only statuses
+      # returned before the request was processed leave it unchecked.
+      idempotent = task is not take_backup
+      if is_retryable(err, idempotent):
+        record['result'] = 'unchecked'
+        instances_checked.labels(result='unchecked').inc()
+      elif is_retryable(err):
+        record['result'] = 'unknown'
+        report_unknown_backup(context, instance)
+      record['error'] = error.get_json().get('error')
+      record['errorCode'] = err_code
+  record['durationSeconds'] = round(time.monotonic() - started, 3)
+  return record
+
+
+def iter_task_results(context, tasks, max_concurrency):
+  max_concurrency = max(1, int(max_concurrency))
+  with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+    running = set()
+    for task in tasks:
+      running.add(executor.submit(run_instance_task, context, *task))
+      if len(running) >= max_concurrency * 2:
+        done, running = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+          yield future.result()
+    while running:
+      done, running = wait(running, return_when=FIRST_COMPLETED)
+      for future in done:
+        yield future.result()
+
+
+def wants_stream(data):
+  return bool(data.get('stream')) \
+    or 'application/x-ndjson' in request.headers.get('Accept', str())
+
+
+def stream_records(records):
+  return app.response_class(
+    stream_with_context(
+      json.dumps(record, sort_keys=True) + '\n' for record in records
+    ),
+    mimetype='application/x-ndjson'
+  )
+
+
+def get_thresholds(context, data):
+  thresholds = dict(data.get('threshold') or dict())
+  if data.get('discover') is not None:
+    for instance in discover_instances(context, data.get('discover')):
+      thresholds.setdefault(
+        instance, data.get('discover').get(
+          'defaultThreshold', DEFAULT_DISCOVERY_THRESHOLD
+        )
+      )
+  return thresholds
+
+
+def report_unchecked_instances(context, instances):
+  if not instances:
+    return
+  reason = 'API errors'
+  if context.retry_budget.exhausted:
+    reason = 'API errors, retry budget exhausted'
+  message = str(len(instances)) + ' instances could not be checked (' \
+    + reason + '). \n `Instance Names: ' \
+    + ', '.join(instances[:MAX_REPORTED_UNCHECKED])
+  if len(instances) > MAX_REPORTED_UNCHECKED:
+    message += ' and ' + str(len(instances) - MAX_REPORTED_UNCHECKED) \
+      + ' more'
+  send_msg_to_slack(context, message + '`')
+
+
+def iter_checked_records(context, tasks, max_concurrency):
+  context.retry_budget.add_items(len(tasks))
+  unchecked = list()
+  for record in iter_task_results(context, tasks, max_concurrency):
+    if record['result'] == 'unchecked':
+      unchecked.append(str(record['instance']))
+    yield record
+  report_unchecked_instances(context, unchecked)
+
+
+def iter_backup_report(context, data, thresholds, instances, title):
+  tasks = [
+    (get_backup, instance, threshold, False)
+    for instance, threshold in thresholds.items()
+  ]
+  tasks.extend((take_backup, instance) for instance in instances)
+  start_notifications(context, data.get('notificationMode'), title)
+  try:
+    for record in iter_checked_records(
+        context, tasks, data.get('maxConcurrency', DEFAULT_MAX_CONCURRENCY)):
+      yield record
+    operation_timeout = float(
+      data.get('operationTimeout', DEFAULT_OPERATION_TIMEOUT)
+    )
+    if operation_timeout > 0 and context.backup_operations:
+      backups = track_operations(
+        context, context.backup_operations, operation_timeout
+      )
+      for instance, outcome in backups.items():
+        yield dict(outcome, type='backup', instance=instance)
+  finally:
+    flush_notifications(context)
+
+
+def run_backup_report(context, data, thresholds, instances, title):
+  backups = dict()
+  for record in iter_backup_report(
+      context, data, thresholds, instances, title):
+    if record['type'] == 'backup':
+      backups[record.pop('instance')] = record
+      record.pop('type')
+  return backups
+
+
+def iter_status_checks(context, data, instances):
+  start_notifications(
+    context, data.get('notificationMode'),
+    'Cloud SQL backup status for ' + str(context.project_id)
+  )
+  try:
+    for record in iter_checked_records(
+        context,
+        [(get_backup, instance, 0, True) for instance in instances],
+        data.get('maxConcurrency', DEFAULT_MAX_CONCURRENCY)):
+      yield record
+  finally:
+    flush_notifications(context)
+
+
+def get_schedule_key(project_id=None):
+  if project_id is None:
+    return SCHEDULE_STATE_KEY + '/projects'
+  return SCHEDULE_STATE_KEY + '/' + str(project_id)
+
+
+def get_trigger_key(project_id, instance):
+  return get_schedule_key(project_id) + '/backup/' + str(instance)
+
+
+def get_schedule_record(data):
+  return dict(
+    (field, data[field]) for field in SCHEDULE_FIELDS if field in data
+  )
+
+
+def run_scheduled_check(key):
+  project_id, instance = key
+  schedule = scheduled_projects.get(project_id)
+  if schedule is None or instance not in schedule['thresholds']:
+    return None
+  if not schedule_lease.acquire(project_id):
+    return time.time() + schedule_lease.lease_seconds
+  context = copy.copy(schedule['context'])
+  context.retry_budget = RetryBudget(schedule['retryBudget'])
+  context.backup_operations = dict()
+  lead_seconds = schedule['leadSeconds']
+  record = run_instance_task(
+    context, get_backup, instance, schedule['thresholds'][instance], False,
+    lead_seconds
+  )
+  state = run_state_store.get(get_state_key(context, instance, False)) \
+    or dict()
+  if record['result'] == 'due':
+    trigger_key = get_trigger_key(project_id, instance)
+    triggered = run_state_store.get(trigger_key) or dict()
+    if triggered.get('backupId') != state.get('backupId'):
+      run_state_store.put(trigger_key, {'backupId': state.get('backupId')})
+      run_instance_task(context, take_backup, instance)
+  now = time.time()
+  deadline = state.get('nextCheckAt', 0)
+  next_due = deadline - lead_seconds
+  if next_due <= now:
+    next_due = deadline if deadline > now else now + context.recheck_interval
+  return next_due
+
+
+def report_scheduler_failure(key, err):
+  log_to_stackdriver(
+    None,
+    {
+      "message": str(err),
+      "projectID": str(key[0]),
+      "instanceName": str(key[1]),
+      "functionName": "run_scheduled_check"
+    },
+    'ERROR'
+  )
+
+
+scheduled_projects = dict()
+schedule_lease = ScheduleLease(
+  run_state_store,
+  float(os.environ.get(
+    'SCHEDULE_LEASE_SECONDS', DEFAULT_SCHEDULE_LEASE_SECONDS
+  ))
+)
+deadline_scheduler = DeadlineScheduler(
+  run_scheduled_check,
+  max_workers=int(os.environ.get('SCHEDULER_WORKERS', 4)),
+  on_error=report_scheduler_failure,
+  retry_interval=DEFAULT_RECHECK_INTERVAL
+)
+
+
+def register_schedule(context, data, thresholds):
+  lead_seconds = float(data.get('backupLeadMinutes', 0)) * 60
+  previous = scheduled_projects.get(context.project_id)
+  scheduled_projects[context.project_id] = {
+    'context': context,
+    'thresholds': thresholds,
+    'leadSeconds': lead_seconds,
+    'retryBudget': data.get('retryBudget', DEFAULT_RETRY_BUDGET)
+  }
+  now = time.time()
+  for instance, threshold_min in thresholds.items():
+    state = run_state_store.get(get_state_key(context, instance, False))
+    due = now
+    if state is not None and not is_check_due(state, threshold_min):
+      due = max(now, state.get('nextCheckAt', 0) - lead_seconds)
+    deadline_scheduler.schedule((context.project_id, instance), due)
+  if previous is not None:
+    for instance in previous['thresholds']:
+      if instance not in thresholds:
+        deadline_scheduler.cancel((context.project_id, instance))
+
+
+def unregister_schedule(project_id):
+  schedule = scheduled_projects.pop(project_id, None)
+  if schedule is None:
+    return False
+  for instance in schedule['thresholds']:
+    deadline_scheduler.cancel((project_id, instance))
+    run_state_store.delete(get_trigger_key(project_id, instance))
+  schedule_lease.release(project_id)
+  return True
+
+
+def restore_schedules():
+  project_ids = run_state_store.get(get_schedule_key()) or []
+  slack_token = os.environ.get('SCHEDULER_SLACK_TOKEN')
+  if project_ids and slack_token is None:
+    log_to_stackdriver(
+      None,
+      {
+        "message": 'SCHEDULER_SLACK_TOKEN is not set, schedules are not '
+                   'restored',
+        "projects": len(project_ids),
+        "functionName": "restore_schedules"
+      },
+      'WARNING'
+    )
+    return
+  for project_id in project_ids:
+    data = run_state_store.get(get_schedule_key(project_id))
+    if data is None:
+      continue
+    data = get_schedule_record(data)
+    try:
+      with app.app_context():
+        context, message, err_code = set_metadata(
+          data.get('slackChannelName'), data.get('projectID'),
+          data.get('serviceName'), data.get('region'), slack_token
+        )
+        set_request_options(context, data)
+        register_schedule(context, data, get_thresholds(context, data))
+    except Exception as err:
+      report_scheduler_failure((project_id, None), err)
+
+
+def get_shard_key(run_id, shard_index=None):
+  if shard_index is None:
+    return 'shards/' + str(run_id)
+  return 'shards/' + str(run_id) + '/' + str(shard_index)
+
+
+def build_shard_bodies(data, run_id, thresholds, instances, shard_size):
+  items = [('threshold', instance, threshold)
+           for instance, threshold in thresholds.items()]
+  items.extend(('instances', instance, None) for instance in instances)
+  shards = split_shards(items, shard_size)
+  bodies = list()
+  for shard_index, shard in enumerate(shards):
+    body = dict(data)
+    body.pop('discover', None)
+    body.update({
+      'runID': run_id,
+      'shardIndex': shard_index,
+      'shardCount': len(shards),
+      'threshold': dict(
+        (instance, threshold)
+        for kind, instance, threshold in shard if kind == 'threshold'
+      ),
+      'instances': [
+        instance for kind, instance, threshold in shard
+        if kind == 'instances'
+      ]
+    })
+    bodies.append(body)
+  return bodies
+
+
+def dispatch_shards(context, run_id, bodies):
+  failed_shards = list()
+  for body in bodies:
+    try:
+      shard_dispatcher.dispatch(body)
+    except Exception as err:
+      failed_shards.append(body['shardIndex'])
+      run_state_store.put(get_shard_key(run_id, body['shardIndex']), {
+        'status': 'DISPATCH_FAILED',
+        'error': str(err)
+      })
+      log_to_stackdriver(
+        context,
+        {
+          "message": str(err),
+          "runID": run_id,
+          "shardIndex": str(body['shardIndex']),
+          "functionName": "dispatch_shards"
+        },
+        'ERROR'
+      )
+  return failed_shards
+
+
+def get_shard_run(run_id):
+  run = run_state_store.get(get_shard_key(run_id))
+  if run is None:
+    return None
+  summary = {
+    'runID': run_id,
+    'shardCount': run['shardCount'],
+    'instances': run['instances'],
+    'dispatchedAt': run['dispatchedAt'],
+    'completed': 0,
+    'pendingShards': list(),
+    'failedShards': list(),
+    'backups': dict()
+  }
+  for shard_index in range(run['shardCount']):
+    shard = run_state_store.get(get_shard_key(run_id, shard_index)) or dict()
+    if shard.get('status') == 'DONE':
+      summary['completed'] += 1
+      summary['backups'].update(shard.get('backups') or dict())
+    elif shard.get('status') == 'DISPATCH_FAILED':
+      summary['failedShards'].append(shard_index)
+    else:
+      summary['pendingShards'].append(shard_index)
+  return summary
+
+
 @app.route('/checkBackup', methods=['POST'])
 def check_backup():
+  context = None
   try:
     data = request.get_json(force=True)
-    error, message, err_code = set_metadata(
+    context, message, err_code = set_metadata(
       data.get('slackChannelName'), data.get('projectID'),
       data.get('serviceName'), data.get('region'), data.get('slackToken')
     )
-    if error:
+    if context is None:
       return message, err_code
-    for instance in data.get('instances'):
-      try:
-        get_backup(instance, 0, True)
-        time.sleep(2)
-      except HttpError as err:
-        error, err_code = catch_error('HttpError', err, str(instance))
-        continue
+    set_request_options(context, data)
+    instances = list(data.get('instances') or [])
+    if data.get('discover') is not None:
+      instances.extend(discover_instances(context, data.get('discover')))
+    instances = list(dict.fromkeys(instances))
+    records = iter_status_checks(context, data, instances)
+    if wants_stream(data):
+      return stream_records(records)
+    for record in records:
+      pass
     return jsonify({"info": "Processes successfully initiated."}), 200
   except BadRequest as err:
-    error, err_code = catch_error('BadRequest', err, str())
+    error, err_code = catch_error(context, 'BadRequest', err, str())
     return error, err_code
 #   except Exception as err:
 #     error, err_code = catch_error('Exception', err, str())
 #     return error, err_code 
 
 
-@tenacity.retry(
-  wait=tenacity.wait_fixed(5),
-  stop=tenacity.stop_after_attempt(3),
-  retry=tenacity.retry_if_exception_type(ConnectionResetError) | 
-  tenacity.retry_if_exception_type(BrokenPipeError) |
-  tenacity.retry_if_exception_type(IOError))
 @app.route('/', methods=['POST'])
 def parse_json():
+  context = None
   try:
     data = request.get_json(force=True)
-    error, message, err_code = set_metadata(
+    context, message, err_code = set_metadata(
       data.get('slackChannelName'), data.get('projectID'),
       data.get('serviceName'), data.get('region'), data.get('slackToken')
     )
-    if error:
+    if context is None:
       return message, err_code
-    for instance, threshold in data.get('threshold').items():
-      try:
-        get_backup(instance, threshold, False)
-        time.sleep(2)
-      except HttpError as err:
-        error, err_code = catch_error('HttpError', err, str(instance))
-        continue
-    for instance in data.get('instances'):
-      try:
-        take_backup(instance)
-        time.sleep(2)
-      except HttpError as err:
-        error, err_code = catch_error('HttpError', err, str(instance))
-        continue
-    return jsonify({"info": "Processes successfully initiated."}), 200
+    set_request_options(context, data)
+    thresholds = get_thresholds(context, data)
+    title = 'Cloud SQL backup report for ' + str(context.project_id)
+    if wants_stream(data):
+      return stream_records(iter_backup_report(
+        context, data, thresholds, data.get('instances') or [], title
+      ))
+    backups = run_backup_report(
+      context, data, thresholds, data.get('instances') or [], title
+    )
+    return jsonify({
+      "info": "Processes successfully initiated.",
+      "backups": backups
+    }), 200
   except BadRequest as err:
-    error, err_code = catch_error('BadRequest', err, str())
+    error, err_code = catch_error(context, 'BadRequest', err, str())
     return error, err_code
 #   except Exception as err:
 #     error, err_code = catch_error('Exception', err, str())
 #     return error, err_code   
 
 
+@app.route('/shards', methods=['POST'])
+def coordinate_shards():
+  context = None
+  try:
+    data = request.get_json(force=True)
+    context, message, err_code = set_metadata(
+      data.get('slackChannelName'), data.get('projectID'),
+      data.get('serviceName'), data.get('region'), data.get('slackToken')
+    )
+    if context is None:
+      return message, err_code
+    set_request_options(context, data)
+    run_id = uuid.uuid4().hex
+    thresholds = get_thresholds(context, data)
+    instances = list(data.get('instances') or [])
+    bodies = build_shard_bodies(
+      data, run_id, thresholds, instances,
+      data.get('shardSize', DEFAULT_SHARD_SIZE)
+    )
+    run_state_store.put(get_shard_key(run_id), {
+      'shardCount': len(bodies),
+      'instances': len(thresholds) + len(instances),
+      'dispatchedAt': time.time()
+    })
+    failed_shards = dispatch_shards(context, run_id, bodies)
+    log_to_stackdriver(
+      context,
+      {
+        "message": "Shards dispatched.",
+        "runID": run_id,
+        "shardCount": str(len(bodies)),
+        "failedShards": str(len(failed_shards)),
+        "functionName": "coordinate_shards"
+      },
+      'INFO'
+    )
+    return jsonify({
+      "info": "Shards dispatched.",
+      "runID": run_id,
+      "shardCount": len(bodies),
+      "failedShards": failed_shards
+    }), 200
+  except BadRequest as err:
+    error, err_code = catch_error(context, 'BadRequest', err, str())
+    return error, err_code
+
+
+@app.route('/shardWorker', methods=['POST'])
+def run_shard():
+  context = None
+  try:
+    data = read_shard_body(request.get_json(force=True))
+    if data.get('runID') is None or data.get('shardIndex') is None:
+      return jsonify({"error": str('Please provide runID and shardIndex')}), \
+        403
+    context, message, err_code = set_metadata(
+      data.get('slackChannelName'), data.get('projectID'),
+      data.get('serviceName'), data.get('region'), data.get('slackToken')
+    )
+    if context is None:
+      return message, err_code
+    shard_key = get_shard_key(data.get('runID'), data.get('shardIndex'))
+    shard = run_state_store.get(shard_key)
+    if shard is not None and shard.get('status') == 'DONE':
+      return jsonify({"info": "Shard already processed."}), 200
+    set_request_options(context, data)
+    started = time.time()
+    backups = run_backup_report(
+      context, data, data.get('threshold') or dict(),
+      data.get('instances') or [],
+      'Cloud SQL backup report for ' + str(context.project_id)
+      + ' (shard ' + str(int(data.get('shardIndex')) + 1) + ' of '
+      + str(data.get('shardCount')) + ')'
+    )
+    run_state_store.put(shard_key, {
+      'status': 'DONE',
+      'instances': len(data.get('threshold') or dict())
+      + len(data.get('instances') or []),
+      'backups': backups,
+      'startedAt': started,
+      'finishedAt': time.time()
+    })
+    return jsonify({
+      "info": "Shard processed.",
+      "backups": backups
+    }), 200
+  except BadRequest as err:
+    error, err_code = catch_error(context, 'BadRequest', err, str())
+    return error, err_code
+
+
+@app.route('/shards/<run_id>', methods=['GET'])
+def shard_run_status(run_id):
+  summary = get_shard_run(run_id)
+  if summary is None:
+    return jsonify({"error": 'Unknown runID'}), 404
+  return jsonify(summary), 200
+
+
+@app.route('/status', methods=['GET'])
+def backup_status():
+  body, etag, checked_at = status_cache.get()
+  now = time.time()
+  if etag in request.if_none_match:
+    response = app.response_class(status=304)
+  else:
+    response = app.response_class(body, mimetype='application/json')
+  response.set_etag(etag)
+  response.headers['Cache-Control'] = 'no-cache'
+  response.headers['X-Status-Stale'] = str(
+    status_cache.is_stale(checked_at, now)
+  ).lower()
+  if checked_at is not None:
+    response.headers['Age'] = str(int(max(0, now - checked_at)))
+  return response
+
+
+@app.route('/schedule', methods=['POST'])
+def schedule_backups():
+  context = None
+  try:
+    data = request.get_json(force=True)
+    context, message, err_code = set_metadata(
+      data.get('slackChannelName'), data.get('projectID'),
+      data.get('serviceName'), data.get('region'), data.get('slackToken')
+    )
+    if context is None:
+      return message, err_code
+    set_request_options(context, data)
+    thresholds = get_thresholds(context, data)
+    register_schedule(context, data, thresholds)
+    run_state_store.put(
+      get_schedule_key(context.project_id), get_schedule_record(data)
+    )
+    project_ids = run_state_store.get(get_schedule_key()) or []
+    if context.project_id not in project_ids:
+      run_state_store.put(
+        get_schedule_key(), project_ids + [context.project_id]
+      )
+    return jsonify({
+      "info": "Instances scheduled.",
+      "instances": len(thresholds),
+      "scheduler": deadline_scheduler.stats()
+    }), 200
+  except BadRequest as err:
+    error, err_code = catch_error(context, 'BadRequest', err, str())
+    return error, err_code
+
+
+@app.route('/schedule', methods=['GET'])
+def schedule_stats():
+  return jsonify(dict(
+    deadline_scheduler.stats(),
+    lease=schedule_lease.stats(),
+    projects=dict(
+      (project_id, len(schedule['thresholds']))
+      for project_id, schedule in list(scheduled_projects.items())
+    )
+  )), 200
+
+
+@app.route('/schedule/<project_id>', methods=['DELETE'])
+def delete_schedule(project_id):
+  removed = unregister_schedule(project_id)
+  run_state_store.delete(get_schedule_key(project_id))
+  project_ids = run_state_store.get(get_schedule_key()) or []
+  if project_id in project_ids:
+    project_ids.remove(project_id)
+    run_state_store.put(get_schedule_key(), project_ids)
+  if not removed:
+    return jsonify({"error": 'Unknown projectID'}), 404
+  return jsonify({"info": "Schedule removed."}), 200
+
+
+@app.route('/slackCacheStats', methods=['GET'])
+def slack_cache_stats():
+  return jsonify(channel_cache.stats()), 200
+
+
+@app.route('/slackQueueStats', methods=['GET'])
+def slack_queue_stats():
+  return jsonify(slack_dispatcher.stats()), 200
+
+
+@app.route('/retryStats', methods=['GET'])
+def retry_stats():
+  return jsonify(retry_counters.stats()), 200
+
+
+@app.route('/transportStats', methods=['GET'])
+def transport_stats():
+  return jsonify(transport_pool.stats()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def export_metrics():
+  body, content_type = metrics.render(request.headers.get('Accept'))
+  return body, 200, {'Content-Type': content_type}
+
+
+metrics.register_stats('transport', transport_pool.stats)
+metrics.register_stats('slack_queue', slack_dispatcher.stats)
+metrics.register_stats('slack_channel_cache', channel_cache.stats)
+metrics.register_stats('log_sink', log_sink.stats)
+metrics.register_stats('shard_dispatch', shard_dispatcher.stats)
+metrics.register_stats('status_cache', status_cache.stats)
+metrics.register_stats('deadline_scheduler', deadline_scheduler.stats)
+metrics.register_stats('schedule_lease', schedule_lease.stats)
+metrics.register_stats(
+  'api_retry_events', retry_counters.stats,
+  labels=('function', 'outcome', 'reason'), counter=True
+)
+
+
+if float(os.environ.get('STATUS_REFRESH_INTERVAL', 0)) > 0:
+  status_cache.start(
+    [project_id.strip() for project_id
+     in os.environ.get('STATUS_PROJECT_IDS', str()).split(',')
+     if project_id.strip()],
+    refresh_project_status,
+    float(os.environ.get('STATUS_REFRESH_INTERVAL')),
+    report_status_failure
+  )
+threading.Thread(target=restore_schedules, daemon=True).start()
+schedule_lease.start()
+
+
+log_to_stackdriver(
+  None,
+  {
+    "message": "Application loaded.",
+    "loadSeconds": str(round(time.monotonic() - load_started, 3))
+  },
+  'INFO'
+)
+
+
 if __name__ == '__main__':
-  app.run(host='0.0.0.0', debug=True)
+  app.run(host='0.0.0.0')
@@ -0,0 +1,159 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DeadlineScheduler(object):
+
+  def __init__(self, run_entry, max_workers=4, on_error=None,
+               retry_interval=300):
+    self.run_entry = run_entry
+    self.on_error = on_error
+    self.retry_interval = retry_interval
+    self.heap = list()
+    self.due = dict()
+    self.sequence = itertools.count()
+    self.condition = threading.Condition()
+    self.executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)))
+    self.worker = None
+    self.executed, self.failed = 0, 0
+
+  def schedule(self, key, due):
+    with self.condition:
+      self.due[key] = due
+      heapq.heappush(self.heap, (due, next(self.sequence), key))
+      if self.worker is None:
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+      self.condition.notify()
+
+  def cancel(self, key):
+    with self.condition:
+      self.due.pop(key, None)
+      self.condition.notify()
+
+  def peek(self):
+    while self.heap:
+      due, _, key = self.heap[0]
+      if self.due.get(key) == due:
+        return due, key
+      heapq.heappop(self.heap)
+    return None, None
+
+  def run(self):
+    while True:
+      with self.condition:
+        due, key = self.peek()
+        now = time.time()
+        if due is None or due > now:
+          self.condition.wait(None if due is None else due - now)
+          continue
+        heapq.heappop(self.heap)
+        del self.due[key]
+      self.executor.submit(self.execute, key)
+
+  def execute(self, key):
+    try:
+      next_due = self.run_entry(key)
+    except Exception as err:
+      # A failed check keeps its place, it is retried after retry_interval.
+      next_due = time.time() + self.retry_interval
+      with self.condition:
+        self.failed += 1
+      if self.on_error is not None:
+        self.on_error(key, err)
+    with self.condition:
+      self.executed += 1
+    if next_due is not None:
+      self.schedule(key, next_due)
+
+  def stats(self):
+    with self.condition:
+      due, key = self.peek()
+      return {
+        'scheduled': len(self.due),
+        'executed': self.executed,
+        'failed': self.failed,
+        'nextDueInSeconds': round(max(0, due - time.time()), 3)
+        if due is not None else -1
+      }
+
+
+class ScheduleLease(object):
+
+  def __init__(self, state_store, lease_seconds=60, owner=None):
+    self.state_store = state_store
+    self.lease_seconds = lease_seconds
+    self.owner = owner or uuid.uuid4().hex + ':' + str(os.getpid())
+    self.held = set()
+    self.lock = threading.Lock()
+    self.acquired, self.rejected = 0, 0
+
+  def key(self, name):
+    return 'schedule/lease/' + str(name)
+
+  def acquire(self, name):
+    now = time.time()
+    lease = self.state_store.get(self.key(name))
+    if lease is not None and lease.get('owner') != self.owner \
+       and lease.get('expiresAt', 0) > now:
+      with self.lock:
+        self.held.discard(name)
+        self.rejected += 1
+      return False
+    self.state_store.put(self.key(name), {
+      'owner': self.owner,
+      'expiresAt': now + self.lease_seconds
+    })
+    # The store has no compare-and-set, the lease belongs to the last writer.
+    lease = self.state_store.get(self.key(name)) or dict()
+    with self.lock:
+      if lease.get('owner') != self.owner:
+        self.held.discard(name)
+        self.rejected += 1
+        return False
+      if name not in self.held:
+        self.held.add(name)
+        self.acquired += 1
+    return True
+
+  def release(self, name):
+    with self.lock:
+      if name not in self.held:
+        return
+      self.held.discard(name)
+    lease = self.state_store.get(self.key(name))
+    if lease is not None and lease.get('owner') == self.owner:
+      self.state_store.delete(self.key(name))
+
+  def start(self, interval=None):
+    thread = threading.Thread(
+      target=self.run, args=(interval or self.lease_seconds / 3.0,),
+      daemon=True
+    )
+    thread.start()
+    return thread
+
+  def run(self, interval):
+    while True:
+      time.sleep(interval)
+      with self.lock:
+        held = list(self.held)
+      for name in held:
+        try:
+          self.acquire(name)
+        except Exception:
+          with self.lock:
+            self.held.discard(name)
+
+  def stats(self):
+    with self.lock:
+      return {
+        'held': len(self.held),
+        'acquired': self.acquired,
+        'rejected': self.rejected
+      }
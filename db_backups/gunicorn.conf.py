@@ -0,0 +1,7 @@
+import os
+
+
+bind = ':' + os.environ.get('PORT', '5000')
+workers = int(os.environ.get('WORKERS', 1))
+threads = int(os.environ.get('THREADS', 8))
+timeout = int(os.environ.get('TIMEOUT', 0))
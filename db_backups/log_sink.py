@@ -0,0 +1,133 @@
+import atexit
+import os
+import queue
+import random
+import threading
+import time
+
+
+SEVERITY_LEVELS = {
+  'DEFAULT': 0,
+  'DEBUG': 100,
+  'INFO': 200,
+  'NOTICE': 300,
+  'WARNING': 400,
+  'ERROR': 500,
+  'CRITICAL': 600,
+  'ALERT': 700,
+  'EMERGENCY': 800
+}
+
+
+class LogSink(object):
+
+  def __init__(self, logger, queue_size=10000, batch_size=100,
+               flush_interval=2.0, min_severity='DEFAULT', sample_rate=1.0,
+               on_commit=None):
+    self.logger = logger
+    self.on_commit = on_commit
+    self.queue = queue.Queue(maxsize=queue_size)
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.min_level = SEVERITY_LEVELS.get(str(min_severity).upper(), 0)
+    self.sample_rate = sample_rate
+    self.written, self.failed, self.dropped, self.suppressed = 0, 0, 0, 0
+    self.unreported_drops = 0
+    self.lock = threading.Lock()
+    self.worker = threading.Thread(target=self.run, daemon=True)
+    self.worker.start()
+    atexit.register(self.flush)
+
+  @classmethod
+  def from_env(cls, logger, on_commit=None):
+    return cls(
+      logger,
+      queue_size=int(os.environ.get('LOG_QUEUE_SIZE', 10000)),
+      batch_size=int(os.environ.get('LOG_BATCH_SIZE', 100)),
+      flush_interval=float(os.environ.get('LOG_FLUSH_INTERVAL', 2.0)),
+      min_severity=os.environ.get('LOG_MIN_SEVERITY', 'DEFAULT'),
+      sample_rate=float(os.environ.get('LOG_SAMPLE_RATE', 1.0)),
+      on_commit=on_commit
+    )
+
+  def log_struct(self, message, resource, severity):
+    level = SEVERITY_LEVELS.get(severity, 0)
+    if level < self.min_level or (
+        level < SEVERITY_LEVELS['WARNING']
+        and random.random() >= self.sample_rate):
+      with self.lock:
+        self.suppressed += 1
+      return
+    try:
+      self.queue.put_nowait((message, resource, severity))
+    except queue.Full:
+      with self.lock:
+        self.dropped += 1
+        self.unreported_drops += 1
+
+  def flush(self, timeout=5.0):
+    flushed = threading.Event()
+    try:
+      self.queue.put(flushed, timeout=timeout)
+    except queue.Full:
+      return False
+    return flushed.wait(timeout)
+
+  def run(self):
+    entries = list()
+    deadline = time.monotonic() + self.flush_interval
+    while True:
+      try:
+        item = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+      except queue.Empty:
+        item = None
+      if isinstance(item, threading.Event):
+        self.commit(entries)
+        entries = list()
+        deadline = time.monotonic() + self.flush_interval
+        item.set()
+        continue
+      if item is not None:
+        entries.append(item)
+      if len(entries) >= self.batch_size or time.monotonic() >= deadline:
+        self.commit(entries)
+        entries = list()
+        deadline = time.monotonic() + self.flush_interval
+
+  def commit(self, entries):
+    with self.lock:
+      unreported_drops, self.unreported_drops = self.unreported_drops, 0
+    if unreported_drops:
+      entries = entries + [(
+        {
+          'message': 'Log queue full, dropped log entries.',
+          'droppedEntries': str(unreported_drops)
+        },
+        entries[0][1] if entries else None,
+        'WARNING'
+      )]
+    if not entries:
+      return
+    batch = self.logger.batch()
+    for message, resource, severity in entries:
+      batch.log_struct(message, resource=resource, severity=severity)
+    started = time.monotonic()
+    try:
+      batch.commit()
+      with self.lock:
+        self.written += len(entries)
+    except Exception:
+      with self.lock:
+        self.failed += len(entries)
+    if self.on_commit is not None:
+      self.on_commit(time.monotonic() - started)
+
+  def stats(self):
+    with self.lock:
+      return {
+        'written': self.written,
+        'failed': self.failed,
+        'dropped': self.dropped,
+        'suppressed': self.suppressed,
+        'queued': self.queue.qsize()
+      }
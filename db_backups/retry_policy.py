@@ -0,0 +1,155 @@
+import collections
+import threading
+
+import tenacity
+from googleapiclient.errors import HttpError
+
+
+RETRYABLE_STATUS_CODES = frozenset([408, 429, 500, 502, 503, 504])
+# Statuses returned before a request is processed, safe to retry for inserts.
+UNPROCESSED_STATUS_CODES = frozenset([429, 503])
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_DEADLINE = 60
+DEFAULT_INITIAL_WAIT = 1
+DEFAULT_MAX_WAIT = 30
+
+
+class RetryBudget(object):
+
+  def __init__(self, retries, retries_per_item=0):
+    self.remaining = float(retries)
+    self.retries_per_item = float(retries_per_item)
+    self.exhausted = False
+    self.lock = threading.Lock()
+
+  def add_items(self, count):
+    with self.lock:
+      self.remaining += count * self.retries_per_item
+
+  def acquire(self):
+    with self.lock:
+      if self.remaining < 1:
+        self.exhausted = True
+        return False
+      self.remaining -= 1
+      return True
+
+
+class RetryCounters(object):
+
+  def __init__(self):
+    self.counts = collections.Counter()
+    self.lock = threading.Lock()
+
+  def record(self, function_name, outcome, reason):
+    with self.lock:
+      self.counts[(function_name, outcome, reason)] += 1
+
+  def stats(self):
+    stats = dict()
+    with self.lock:
+      counts = dict(self.counts)
+    for (function_name, outcome, reason), count in counts.items():
+      stats.setdefault(function_name, dict()).setdefault(
+        outcome, dict()
+      )[reason] = count
+    return stats
+
+
+retry_counters = RetryCounters()
+
+
+def get_reason(exception):
+  if isinstance(exception, HttpError):
+    return str(exception.resp.status)
+  return type(exception).__name__
+
+
+def is_retryable(exception, idempotent=True):
+  if isinstance(exception, HttpError):
+    status_codes = RETRYABLE_STATUS_CODES if idempotent \
+      else UNPROCESSED_STATUS_CODES
+    return int(exception.resp.status) in status_codes
+  return isinstance(exception, IOError)
+
+
+def get_retry_after(exception):
+  if not isinstance(exception, HttpError):
+    return 0
+  try:
+    return max(0, float(exception.resp.get('retry-after', 0)))
+  except (TypeError, ValueError):
+    return 0
+
+
+def get_retry_budget(retry_state):
+  if retry_state.args:
+    return getattr(retry_state.args[0], 'retry_budget', None)
+  return None
+
+
+class RetryIfBudgeted(object):
+
+  def __init__(self, function_name, idempotent, max_attempts):
+    self.function_name = function_name
+    self.idempotent = idempotent
+    self.max_attempts = max_attempts
+
+  def __call__(self, retry_state):
+    exception = retry_state.outcome.exception()
+    if exception is None or not is_retryable(exception, self.idempotent):
+      return False
+    if retry_state.attempt_number >= self.max_attempts:
+      return True
+    budget = get_retry_budget(retry_state)
+    if budget is not None and not budget.acquire():
+      retry_counters.record(
+        self.function_name, 'budgetExhausted', get_reason(exception)
+      )
+      return False
+    return True
+
+
+class WaitJitterOrRetryAfter(object):
+
+  def __init__(self, initial, maximum):
+    self.jitter = tenacity.wait_random_exponential(
+      multiplier=initial, max=maximum
+    )
+    self.maximum = maximum
+
+  def __call__(self, retry_state):
+    return max(
+      self.jitter(retry_state),
+      min(self.maximum, get_retry_after(retry_state.outcome.exception()))
+    )
+
+
+def api_retry(idempotent=True, max_attempts=DEFAULT_MAX_ATTEMPTS,
+              deadline=DEFAULT_DEADLINE, initial_wait=DEFAULT_INITIAL_WAIT,
+              max_wait=DEFAULT_MAX_WAIT):
+
+  def decorator(function):
+    function_name = function.__name__
+
+    def record_retry(retry_state):
+      retry_counters.record(
+        function_name, 'retried', get_reason(retry_state.outcome.exception())
+      )
+
+    def give_up(retry_state):
+      retry_counters.record(
+        function_name, 'exhausted', get_reason(retry_state.outcome.exception())
+      )
+      return retry_state.outcome.result()
+
+    return tenacity.retry(
+      wait=WaitJitterOrRetryAfter(initial_wait, max_wait),
+      stop=tenacity.stop_after_attempt(max_attempts)
+      | tenacity.stop_after_delay(deadline),
+      retry=RetryIfBudgeted(function_name, idempotent, max_attempts),
+      before_sleep=record_retry,
+      retry_error_callback=give_up
+    )(function)
+
+  return decorator
@@ -0,0 +1,140 @@
+import base64
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_SHARD_DISPATCH = 'local://'
+PUBLISH_TIMEOUT = 30
+
+
+class LocalShardDispatcher(object):
+
+  def __init__(self, handler, max_workers=4):
+    self.handler = handler
+    self.executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)))
+    self.lock = threading.Lock()
+    self.dispatched, self.failed = 0, 0
+
+  def dispatch(self, body):
+    self.executor.submit(self.deliver, json.loads(json.dumps(body)))
+    with self.lock:
+      self.dispatched += 1
+
+  def deliver(self, body):
+    try:
+      response = self.handler(body)
+      failed = response.status_code >= 400
+    except Exception:
+      failed = True
+    if failed:
+      with self.lock:
+        self.failed += 1
+
+  def stats(self):
+    with self.lock:
+      return {'dispatched': self.dispatched, 'failed': self.failed}
+
+
+class CloudTasksShardDispatcher(object):
+
+  def __init__(self, queue_path, worker_url, service_account_email=None):
+    from google.cloud import tasks_v2
+    self.client = tasks_v2.CloudTasksClient()
+    self.queue_path = queue_path
+    self.worker_url = worker_url
+    self.service_account_email = service_account_email
+    self.lock = threading.Lock()
+    self.dispatched, self.failed = 0, 0
+
+  def dispatch(self, body):
+    http_request = {
+      'http_method': 'POST',
+      'url': self.worker_url,
+      'headers': {'Content-Type': 'application/json'},
+      'body': json.dumps(body).encode('utf-8')
+    }
+    if self.service_account_email:
+      http_request['oidc_token'] = {
+        'service_account_email': self.service_account_email
+      }
+    try:
+      self.client.create_task(
+        parent=self.queue_path, task={'http_request': http_request}
+      )
+    except Exception:
+      with self.lock:
+        self.failed += 1
+      raise
+    with self.lock:
+      self.dispatched += 1
+
+  def stats(self):
+    with self.lock:
+      return {'dispatched': self.dispatched, 'failed': self.failed}
+
+
+class PubSubShardDispatcher(object):
+
+  def __init__(self, topic_path):
+    from google.cloud import pubsub_v1
+    self.publisher = pubsub_v1.PublisherClient()
+    self.topic_path = topic_path
+    self.lock = threading.Lock()
+    self.dispatched, self.failed = 0, 0
+
+  def dispatch(self, body):
+    try:
+      self.publisher.publish(
+        self.topic_path, data=json.dumps(body).encode('utf-8')
+      ).result(timeout=PUBLISH_TIMEOUT)
+    except Exception:
+      with self.lock:
+        self.failed += 1
+      raise
+    with self.lock:
+      self.dispatched += 1
+
+  def stats(self):
+    with self.lock:
+      return {'dispatched': self.dispatched, 'failed': self.failed}
+
+
+def open_shard_dispatcher(url, local_handler):
+  scheme, _, location = url.partition('://')
+  if scheme == 'local':
+    return LocalShardDispatcher(local_handler, location or 4)
+  elif scheme == 'cloudtasks':
+    worker_url = os.environ.get('SHARD_WORKER_URL', str())
+    if not worker_url.startswith('https://'):
+      raise ValueError(
+        'SHARD_WORKER_URL must be the https URL of /shardWorker for ' + url
+      )
+    return CloudTasksShardDispatcher(
+      location, worker_url, os.environ.get('SHARD_SERVICE_ACCOUNT')
+    )
+  elif scheme == 'pubsub':
+    return PubSubShardDispatcher(location)
+  raise ValueError('Unsupported shard dispatcher: ' + url)
+
+
+def shard_dispatcher_from_env(local_handler):
+  return open_shard_dispatcher(
+    os.environ.get('SHARD_DISPATCH', DEFAULT_SHARD_DISPATCH), local_handler
+  )
+
+
+def read_shard_body(body):
+  message = body.get('message')
+  if isinstance(message, dict) and 'data' in message:
+    return json.loads(base64.b64decode(message['data']).decode('utf-8'))
+  return body
+
+
+def split_shards(items, shard_size):
+  shard_size = max(1, int(shard_size))
+  return [
+    items[start:start + shard_size]
+    for start in range(0, len(items), shard_size)
+  ]
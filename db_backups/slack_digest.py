@@ -0,0 +1,61 @@
+import threading
+
+
+MAX_BLOCKS_PER_MESSAGE = 50
+MAX_SECTION_TEXT_LENGTH = 3000
+MAX_HEADER_TEXT_LENGTH = 150
+
+
+def section_block(text):
+  if len(text) > MAX_SECTION_TEXT_LENGTH:
+    text = text[:MAX_SECTION_TEXT_LENGTH - 3] + '...'
+  return {
+    'type': 'section',
+    'text': {
+      'type': 'mrkdwn',
+      'text': text
+    }
+  }
+
+
+def header_block(text):
+  return {
+    'type': 'header',
+    'text': {
+      'type': 'plain_text',
+      'text': text[:MAX_HEADER_TEXT_LENGTH]
+    }
+  }
+
+
+class SlackDigest(object):
+
+  def __init__(self, title):
+    self.title = title
+    self.messages = list()
+    self.lock = threading.Lock()
+
+  def add(self, message, on_failure=None):
+    with self.lock:
+      self.messages.append((message, on_failure))
+
+  def build_deliveries(self):
+    with self.lock:
+      messages = list(self.messages)
+    sections_per_message = MAX_BLOCKS_PER_MESSAGE - 1
+    chunks = [
+      messages[start:start + sections_per_message]
+      for start in range(0, len(messages), sections_per_message)
+    ]
+    digests = list()
+    for part, chunk in enumerate(chunks, 1):
+      title = self.title + ' (' + str(len(messages)) + ' findings'
+      if len(chunks) > 1:
+        title += ', part ' + str(part) + '/' + str(len(chunks))
+      title += ')'
+      digests.append((
+        [header_block(title)]
+        + [section_block(message) for message, on_failure in chunk],
+        [on_failure for message, on_failure in chunk if on_failure is not None]
+      ))
+    return digests
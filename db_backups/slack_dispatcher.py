@@ -0,0 +1,192 @@
+import atexit
+import collections
+import os
+import threading
+import time
+
+
+class ChannelQueue(object):
+
+  def __init__(self, burst):
+    self.messages = collections.deque()
+    self.tokens = float(burst)
+    self.updated = time.monotonic()
+    self.blocked_until = 0.0
+
+
+class SlackDispatcher(object):
+
+  def __init__(self, messages_per_second=1.0, burst=3, queue_size=1000,
+               max_attempts=5, drain_timeout=30.0, on_failure=None):
+    self.messages_per_second = messages_per_second
+    self.burst = burst
+    self.queue_size = queue_size
+    self.max_attempts = max_attempts
+    self.drain_timeout = drain_timeout
+    self.on_failure = on_failure
+    self.channels = dict()
+    self.pending = 0
+    self.sent, self.failed, self.retried = 0, 0, 0
+    self.expired, self.dropped = 0, 0
+    self.expire_at = None
+    self.condition = threading.Condition()
+    self.worker = threading.Thread(target=self.run, daemon=True)
+    self.worker.start()
+    atexit.register(self.shutdown)
+
+  @classmethod
+  def from_env(cls, on_failure=None):
+    return cls(
+      messages_per_second=float(
+        os.environ.get('SLACK_MESSAGES_PER_SECOND', 1.0)
+      ),
+      burst=int(os.environ.get('SLACK_BURST', 3)),
+      queue_size=int(os.environ.get('SLACK_QUEUE_SIZE', 1000)),
+      max_attempts=int(os.environ.get('SLACK_MAX_ATTEMPTS', 5)),
+      drain_timeout=float(os.environ.get('SLACK_DRAIN_TIMEOUT', 30.0)),
+      on_failure=on_failure
+    )
+
+  def submit(self, channel_key, send, on_failure=None):
+    with self.condition:
+      if self.pending >= self.queue_size:
+        self.dropped += 1
+        return False
+      channel = self.channels.get(channel_key)
+      if channel is None:
+        channel = self.channels[channel_key] = ChannelQueue(self.burst)
+      channel.messages.append([send, 0, on_failure])
+      self.pending += 1
+      self.condition.notify_all()
+    return True
+
+  def drain(self, timeout=None):
+    deadline = time.monotonic() + (
+      self.drain_timeout if timeout is None else timeout
+    )
+    with self.condition:
+      while self.pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          return False
+        self.condition.wait(remaining)
+    return True
+
+  def shutdown(self):
+    # Messages still queued once the drain timeout passes are discarded.
+    with self.condition:
+      self.expire_at = time.monotonic() + self.drain_timeout
+      self.condition.notify_all()
+    # Give the worker a moment to report the expired messages.
+    return self.drain(self.drain_timeout + 1)
+
+  def is_expired(self, now):
+    return self.expire_at is not None and now > self.expire_at
+
+  def ready_at(self, channel, now):
+    channel.tokens = min(
+      float(self.burst),
+      channel.tokens + (now - channel.updated) * self.messages_per_second
+    )
+    channel.updated = now
+    ready = max(now, channel.blocked_until)
+    if channel.tokens < 1:
+      ready = max(
+        ready, now + (1 - channel.tokens) / self.messages_per_second
+      )
+    return ready
+
+  def next_message(self):
+    with self.condition:
+      while True:
+        now = time.monotonic()
+        ready_key, ready = None, None
+        for channel_key, channel in list(self.channels.items()):
+          if channel.messages and self.is_expired(now):
+            return channel_key, channel, channel.messages[0]
+          channel_ready = self.ready_at(channel, now)
+          if not channel.messages:
+            # Forget idle channels only once their bucket has refilled.
+            if channel.tokens >= self.burst and channel_ready <= now:
+              del self.channels[channel_key]
+            continue
+          if ready is None or channel_ready < ready:
+            ready_key, ready = channel_key, channel_ready
+        if ready_key is None:
+          self.condition.wait()
+        elif ready > now:
+          wait = ready - now
+          if self.expire_at is not None:
+            wait = min(wait, max(0, self.expire_at - now) + 0.01)
+          self.condition.wait(wait)
+        else:
+          channel = self.channels[ready_key]
+          channel.tokens -= 1
+          return ready_key, channel, channel.messages[0]
+
+  def run(self):
+    while True:
+      channel_key, channel, message = self.next_message()
+      send, attempts, on_message_failure = message
+      if self.is_expired(time.monotonic()):
+        self.finish(channel, 'expired', channel_key, 'Drain deadline passed.')
+        continue
+      try:
+        response = send()
+        error = None
+      except Exception as err:
+        response, error = None, err
+      retry_after = get_retry_after(response)
+      if retry_after is None and error is None:
+        self.finish(channel, 'sent')
+        continue
+      message[1] = attempts + 1
+      if message[1] >= self.max_attempts:
+        self.finish(
+          channel, 'failed', channel_key,
+          str(error) if error is not None else 'Rate limited.'
+        )
+        continue
+      with self.condition:
+        self.retried += 1
+        channel.blocked_until = time.monotonic() + (
+          retry_after if retry_after is not None else 2 ** attempts
+        )
+
+  def finish(self, channel, outcome, channel_key=None, reason=None):
+    with self.condition:
+      message = channel.messages.popleft()
+      self.pending -= 1
+      setattr(self, outcome, getattr(self, outcome) + 1)
+      self.condition.notify_all()
+    if reason is None:
+      return
+    if self.on_failure is not None:
+      self.on_failure(channel_key, outcome, reason)
+    if message[2] is not None:
+      message[2]()
+
+  def stats(self):
+    with self.condition:
+      return {
+        'sent': self.sent,
+        'failed': self.failed,
+        'retried': self.retried,
+        'expired': self.expired,
+        'dropped': self.dropped,
+        'pending': self.pending
+      }
+
+
+def get_retry_after(response):
+  if not isinstance(response, dict):
+    return None
+  for key, value in (response.get('headers') or dict()).items():
+    if key.lower() == 'retry-after':
+      try:
+        return max(0.0, float(value))
+      except (TypeError, ValueError):
+        return 1.0
+  if response.get('error') == 'ratelimited':
+    return 1.0
+  return None
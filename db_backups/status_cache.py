@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+STATUS_STATE_KEY = 'status/snapshot'
+
+
+class StatusCache(object):
+
+  def __init__(self, state_store=None, stale_after=900):
+    self.state_store = state_store
+    self.stale_after = stale_after
+    self.entries = dict()
+    self.updated_at = None
+    self.checked_at = None
+    self.body, self.etag = None, None
+    self.dirty = True
+    self.lock = threading.Lock()
+    self.refreshes, self.failed_refreshes = 0, 0
+    self.load()
+
+  @classmethod
+  def from_env(cls, state_store):
+    persist = os.environ.get('STATUS_PERSIST', '1') not in ('0', 'false')
+    return cls(
+      state_store if persist else None,
+      stale_after=float(os.environ.get('STATUS_STALE_AFTER', 900))
+    )
+
+  def load(self):
+    if self.state_store is None:
+      return
+    snapshot = self.state_store.get(STATUS_STATE_KEY)
+    if snapshot is not None:
+      self.entries = snapshot.get('instances') or dict()
+      self.updated_at = snapshot.get('updatedAt')
+
+  def save(self):
+    if self.state_store is None:
+      return
+    with self.lock:
+      snapshot = {
+        'instances': dict(self.entries),
+        'updatedAt': self.updated_at
+      }
+    self.state_store.put(STATUS_STATE_KEY, snapshot)
+
+  def update(self, project_id, instance, entry):
+    with self.lock:
+      self.entries[str(project_id) + '/' + str(instance)] = entry
+      self.updated_at = time.time()
+      self.dirty = True
+
+  def replace_project(self, project_id, entries):
+    prefix = str(project_id) + '/'
+    with self.lock:
+      for key in [key for key in self.entries if key.startswith(prefix)]:
+        if key[len(prefix):] not in entries:
+          del self.entries[key]
+      for instance, entry in entries.items():
+        self.entries[prefix + instance] = entry
+      self.updated_at = time.time()
+      self.dirty = True
+
+  def get_oldest_checked_at(self):
+    checked_at = [
+      entry.get('checkedAt') for entry in self.entries.values()
+      if entry.get('checkedAt') is not None
+    ]
+    return min(checked_at) if checked_at else None
+
+  def render(self):
+    self.checked_at = self.get_oldest_checked_at()
+    self.body = json.dumps({
+      'instances': self.entries,
+      'updatedAt': self.updated_at,
+      'oldestCheckedAt': self.checked_at,
+      'staleAfterSeconds': self.stale_after
+    }, sort_keys=True).encode('utf-8')
+    self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+    self.dirty = False
+
+  def get(self):
+    with self.lock:
+      if self.dirty:
+        self.render()
+      return self.body, self.etag, self.checked_at
+
+  def is_stale(self, checked_at, now=None):
+    if checked_at is None:
+      return True
+    return (now or time.time()) - checked_at > self.stale_after
+
+  def start(self, project_ids, refresh, interval, on_error=None):
+    thread = threading.Thread(
+      target=self.run, args=(project_ids, refresh, interval, on_error),
+      daemon=True
+    )
+    thread.start()
+    return thread
+
+  def run(self, project_ids, refresh, interval, on_error):
+    while True:
+      started = time.monotonic()
+      for project_id in project_ids:
+        try:
+          self.replace_project(project_id, refresh(project_id))
+          with self.lock:
+            self.refreshes += 1
+        except Exception as err:
+          self.report_error(on_error, project_id, err)
+      try:
+        self.save()
+      except Exception as err:
+        self.report_error(on_error, None, err)
+      time.sleep(max(0, interval - (time.monotonic() - started)))
+
+  def report_error(self, on_error, project_id, err):
+    with self.lock:
+      self.failed_refreshes += 1
+    if on_error is not None:
+      on_error(project_id, err)
+
+  def stats(self):
+    with self.lock:
+      if self.dirty:
+        self.render()
+      return {
+        'instances': len(self.entries),
+        'refreshes': self.refreshes,
+        'failedRefreshes': self.failed_refreshes,
+        'ageSeconds': round(time.time() - self.checked_at, 3)
+        if self.checked_at else -1
+      }
@@ -0,0 +1,53 @@
+import datetime
+import re
+
+
+UTC = datetime.timezone.utc
+RFC3339_PATTERN = re.compile(
+  r'(\d{4})-(\d{2})-(\d{2})[Tt ](\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?'
+  r'([Zz]|[+-]\d{2}:\d{2})$'
+)
+
+
+def parse_fraction(fraction):
+  if not fraction:
+    return 0
+  return int((fraction + '000000')[:6])
+
+
+def parse_rfc3339(value):
+  if len(value) >= 20 and value[-1] == 'Z' and value[10] == 'T' \
+     and value[19] in '.Z':
+    return datetime.datetime(
+      int(value[0:4]), int(value[5:7]), int(value[8:10]),
+      int(value[11:13]), int(value[14:16]), int(value[17:19]),
+      parse_fraction(value[20:-1]), tzinfo=UTC
+    )
+  match = RFC3339_PATTERN.match(value)
+  if match is None:
+    raise ValueError('Invalid RFC3339 timestamp: ' + str(value))
+  year, month, day, hour, minute, second, fraction, offset = match.groups()
+  tzinfo = UTC
+  if offset not in ('Z', 'z'):
+    sign = -1 if offset[0] == '-' else 1
+    tzinfo = datetime.timezone(sign * datetime.timedelta(
+      hours=int(offset[1:3]), minutes=int(offset[4:6])
+    ))
+  return datetime.datetime(
+    int(year), int(month), int(day), int(hour), int(minute), int(second),
+    parse_fraction(fraction), tzinfo=tzinfo
+  )
+
+
+def utcnow():
+  return datetime.datetime.now(UTC)
+
+
+def minutes_since(timestamp, now=None):
+  elapsed = (now or utcnow()) - timestamp
+  return int(elapsed.total_seconds() // 60)
+
+
+def days_since(timestamp, now=None):
+  return ((now or utcnow()).astimezone(UTC).date()
+          - timestamp.astimezone(UTC).date()).days
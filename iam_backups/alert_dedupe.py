@@ -0,0 +1,31 @@
+import time
+
+
+class AlertDeduper(object):
+
+  def __init__(self, store):
+    self.store = store
+
+  def get_key(self, project, subject, alert_type):
+    return '/'.join(['alerts', str(project), str(subject), alert_type])
+
+  def check(self, project, subject, alert_type, state, renotify_interval):
+    key = self.get_key(project, subject, alert_type)
+    record = self.store.get(key)
+    now = time.time()
+    if record is not None and record.get('state') == str(state) \
+       and now - record.get('notifiedAt', 0) < renotify_interval:
+      return False, False
+    escalated = record is not None and record.get('state') != str(state)
+    self.store.put(key, {'state': str(state), 'notifiedAt': now})
+    return True, escalated
+
+  def resolve(self, project, subject, alert_type):
+    self.store.delete(self.get_key(project, subject, alert_type))
+
+  def release(self, project, subject, alert_type, state):
+    # Forget an alert whose message was not delivered, so it is sent again.
+    key = self.get_key(project, subject, alert_type)
+    record = self.store.get(key)
+    if record is not None and record.get('state') == str(state):
+      self.store.delete(key)
@@ -115,23 +115,19 @@ createCloudRunService() {
     port="5000"
     echo "port ($port)"
   fi
-  if [[ -z $scriptRepoName ]]; then
-    echo "scriptRepoName not provided"
-    exit 1
-  fi
-  if [[ -z $branch ]]; then
-    branch="master" 
-    echo "branch ($branch)"
+  if [[ -z $workers ]]; then
+    workers="1"
+    echo "workers ($workers)"
   fi
-  if [[ -z $fileName ]]; then 
-    echo "please provide fileName relative to scriptRepoName"
-    exit 1
+  if [[ -z $threads ]]; then
+    threads="8"
+    echo "threads ($threads)"
   fi
   
   echo "Creating cloud run service ($serviceName)..."
   gcloud alpha run deploy $serviceName --image $imageName --region $regionName \
   --service-account $serviceAccount $authentication --platform managed --port $port \
-  --update-env-vars scriptRepoName=$scriptRepoName,fileName=$fileName,branch=$branch
+  --update-env-vars WORKERS=$workers,THREADS=$threads
 }
 
 createScheduler() {
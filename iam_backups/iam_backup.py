@@ -1,235 +1,849 @@
-from flask import Flask, jsonify, request
+import time
+load_started = time.monotonic()
+
+from flask import Flask, g, jsonify, request, stream_with_context
 from google.cloud import logging
 from google.cloud.logging.resource import Resource
 import os
 import google.auth
-import googleapiclient.discovery
 from google.oauth2 import service_account
 from googleapiclient.errors import HttpError
 from werkzeug.exceptions import BadRequest
-from slackclient import SlackClient
+from alert_dedupe import AlertDeduper
+from log_sink import LogSink
+import metrics
+from retry_policy import RetryBudget, api_retry, is_retryable, retry_counters
+from slack_cache import channel_cache
+from slack_digest import SlackDigest, section_block
+from slack_dispatcher import SlackDispatcher
+from snapshot_sink import (DEFAULT_SNAPSHOT_DESTINATION, SnapshotWriter,
+                           content_hash, open_snapshot_sink, read_index,
+                           write_index)
+from state_store import state_store_from_env
+from timestamps import days_since, parse_rfc3339, utcnow
+from transport import TransportPool
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import collections
+import queue
+import threading
 import sys
 import json
-import datetime
-import tenacity
-from datetime import datetime as date
 
 app = Flask(__name__)
 
 credentials, project = google.auth.default(
   scopes=['https://www.googleapis.com/auth/cloud-platform'])
-service = googleapiclient.discovery.build(
-  'iam', 'v1', credentials=credentials)
-channel_name, project_id, service_name, region = str(), str(), str(), str()
-slack_client, cloud_run_resource = None, None
-logger = logging.Client().logger('Cloud-Run-Log')
-account_email = dict()
+transport_pool = TransportPool.from_env(credentials)
+service = transport_pool.build('iam', 'v1')
+keys_resource = service.projects().serviceAccounts().keys()
+log_sink = LogSink.from_env(
+  logging.Client().logger('Cloud-Run-Log'),
+  metrics.logging_write_seconds.observe
+)
+keys_flagged = metrics.Counter(
+  'service_account_keys_flagged', 'User managed keys older than threshold.'
+)
+accounts_checked = metrics.Counter(
+  'service_accounts_checked', 'Service accounts whose keys were checked.'
+)
+accounts_unchecked = metrics.Counter(
+  'service_accounts_unchecked',
+  'Service accounts whose keys could not be listed after retries.'
+)
+alert_deduper = AlertDeduper(state_store_from_env())
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_MAX_CONCURRENCY = 10
+DEFAULT_MAX_PROJECT_CONCURRENCY = 5
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_RENOTIFY_MINUTES = 1440
+DEFAULT_RETRY_BUDGET = 20
+DEFAULT_RETRY_BUDGET_PER_ITEM = 0.1
+MAX_REPORTED_UNCHECKED = 20
+SLACK_REQUEST_TIMEOUT = 10
+STREAM_QUEUE_SIZE = 1000
+
 
+class SlackDeliveryError(Exception):
+  pass
 
-def set_token(token):
-  global slack_client
-  slack_client = SlackClient(token)
 
+class RequestContext(object):
 
-def list_channels():
-  channels_call = slack_client.api_call('channels.list')
+  def __init__(self, project_id, service_name, region, channel_name,
+               slack_token):
+    self.project_id = project_id
+    self.service_name = service_name
+    self.region = region
+    self.channel_name = channel_name
+    self.slack_token = str(slack_token)
+    self.slack_client = transport_pool.get_slack_client(self.slack_token)
+    self.cloud_run_resource = Resource(
+      type='cloud_run_revision',
+      labels={
+        'project_id': project_id,
+        'service_name': service_name,
+        'region': region
+      }
+    )
+    self.notification_digest = None
+    self.renotify_interval = DEFAULT_RENOTIFY_MINUTES * 60
+    self.retry_budget = RetryBudget(DEFAULT_RETRY_BUDGET)
+
+
+def list_channels(context):
+  with metrics.slack_api_seconds.labels(method='channels.list').time():
+    channels_call = context.slack_client.api_call(
+      'channels.list', timeout=SLACK_REQUEST_TIMEOUT
+    )
   if channels_call['ok']:
     return channels_call['channels']
   return None
 
 
-def log_to_stackdriver(message, log_level):
-  logger.log_struct(
-    message,
-    resource=cloud_run_resource,
-    severity=log_level
-  )
+def log_to_stackdriver(context, message, log_level):
+  resource = None
+  if context is not None:
+    resource = context.cloud_run_resource
+  log_sink.log_struct(message, resource, log_level)
 
 
-def send_message(channel_id, message):
+@app.before_request
+def start_request_timer():
+  g.request_started = time.monotonic()
+
+
+@app.after_request
+def observe_request(response):
+  if 'request_started' in g:
+    metrics.request_seconds.labels(
+      endpoint=str(request.endpoint), status=str(response.status_code)
+    ).observe(time.monotonic() - g.request_started)
+  return response
+
+
+@app.teardown_request
+def flush_logs(exception):
+  # Status, stats and metrics reads write no logs, don't wait for the sink.
+  if request.method != 'GET':
+    log_sink.flush()
+
+
+def send_message(context, channel_id, blocks):
   log_to_stackdriver(
+    context,
     {
       'message': 'Making slack api call.',
       'functionName': 'send_message'
     },
     'INFO'
   )
-  slack_client.api_call(
-    'chat.postMessage',
-    channel=channel_id,
-    blocks=[{
-      'type': 'section',
-      'text': {
-        'type': 'mrkdwn',
-        'text': message
-      }
-    }]
-  )
+  with metrics.slack_api_seconds.labels(method='chat.postMessage').time():
+    return context.slack_client.api_call(
+      'chat.postMessage',
+      timeout=SLACK_REQUEST_TIMEOUT,
+      channel=channel_id,
+      blocks=blocks
+    )
 
 
-def send_msg_to_slack(message):
+def send_msg_to_slack(context, message, on_failure=None):
   log_to_stackdriver(
+    context,
     {
       'message': 'Sending message to slack.',
       'functionName': 'send_msg_to_slack'  
     },
     'INFO'
   )
-  channels = list_channels()
-  if channels:
-    for channel in channels:
-      if channel['name'] == channel_name:
-        send_message(channel['id'], message)
+  if context is None:
+    return
+  if context.notification_digest is not None:
+    context.notification_digest.add(message, on_failure)
+    return
+  send_blocks_to_slack(
+    context, [section_block(message)],
+    [on_failure] if on_failure is not None else []
+  )
 
 
-def get_key_date(key_datetime):
-  log_to_stackdriver(
-    {
-      'message': 'Getting key creation date.',
-      'functionName': 'get_key_date'  
-    },
-    'INFO'
-  )
-  strip_date = key_datetime.split('T')
-  key_date = datetime.datetime.strptime(
-  strip_date[0], '%Y-%m-%d')
-  key_date = datetime.datetime.strftime(
-    key_date, '%d-%m-%Y'
+def send_blocks_to_slack(context, blocks, failure_callbacks=()):
+
+  def report_failure():
+    for on_failure in failure_callbacks:
+      on_failure()
+
+  if not slack_dispatcher.submit(
+      (context.slack_token, context.channel_name),
+      lambda: deliver_blocks(context, blocks), report_failure):
+    report_failure()
+    log_to_stackdriver(
+      context,
+      {
+        "message": "Slack queue is full, message dropped.",
+        "functionName": "send_blocks_to_slack"
+      },
+      'WARNING'
+    )
+
+
+def deliver_blocks(context, blocks):
+  channel_id = channel_cache.get_channel_id(
+    context.slack_token, context.channel_name,
+    lambda: list_channels(context)
   )
-  return key_date
+  if not channel_id:
+    raise SlackDeliveryError(
+      'Slack channel not found: ' + str(context.channel_name)
+    )
+  response = send_message(context, channel_id, blocks)
+  if response and response.get('error') == 'channel_not_found':
+    channel_cache.invalidate(context.slack_token, context.channel_name)
+    channel_id = channel_cache.get_channel_id(
+      context.slack_token, context.channel_name,
+      lambda: list_channels(context)
+    )
+    if channel_id:
+      response = send_message(context, channel_id, blocks)
+  if response and not response.get('ok') \
+     and response.get('error') != 'ratelimited':
+    raise SlackDeliveryError('Slack error: ' + str(response.get('error')))
+  return response
 
 
-def calculate_key_days(key_date):
+def report_slack_failure(channel_key, outcome, reason):
   log_to_stackdriver(
+    None,
     {
-      'message': 'Calculating days since key is created.',
-      'functionName': 'calculate_key_days'  
+      "message": "Slack message was not delivered.",
+      "slackChannelName": str(channel_key[1]),
+      "outcome": outcome,
+      "error": reason,
+      "functionName": "report_slack_failure"
     },
-    'INFO'
+    'ERROR'
+  )
+
+
+slack_dispatcher = SlackDispatcher.from_env(report_slack_failure)
+
+
+def notify_alert(context, subject, alert_type, state, message):
+  notify, escalated = alert_deduper.check(
+    context.project_id, subject, alert_type, state,
+    context.renotify_interval
   )
-  current_time = date.utcnow().strftime('%d-%m-%Y')
-  date_format = '%d-%m-%Y'
-  current_time = date.strptime(str(current_time), date_format)
-  key_date = date.strptime(key_date, date_format)
-  delta= current_time - key_date
-  return delta.days
-
-
-@tenacity.retry(
-  wait=tenacity.wait_fixed(5),
-  stop=tenacity.stop_after_attempt(3),
-  retry=tenacity.retry_if_exception_type(ConnectionResetError) | 
-  tenacity.retry_if_exception_type(BrokenPipeError) |
-  tenacity.retry_if_exception_type(IOError))
-def list_service_acc(project_id, data):
-  check_service_account = False
+  if not notify:
+    log_to_stackdriver(
+      context,
+      {
+        'message': 'Alert already sent, skipping.',
+        'subject': str(subject),
+        'alertType': alert_type,
+        'functionName': 'notify_alert'
+      },
+      'INFO'
+    )
+    return
+  if escalated:
+    message = 'Escalation: ' + message
+  send_msg_to_slack(
+    context, message,
+    lambda: alert_deduper.release(
+      context.project_id, subject, alert_type, state
+    )
+  )
+
+
+def start_notifications(context, notification_mode, title):
+  context.notification_digest = None
+  if notification_mode == 'digest':
+    context.notification_digest = SlackDigest(title)
+
+
+def flush_notifications(context):
+  digest, context.notification_digest = context.notification_digest, None
+  if digest is not None:
+    for blocks, failure_callbacks in digest.build_deliveries():
+      send_blocks_to_slack(context, blocks, failure_callbacks)
+
+
+@api_retry()
+def get_service_acc_page(context, api_request):
   log_to_stackdriver(
+    context,
     {
       'message': 'Listing service accounts.',
-      'functionName': 'list_service_acc'
+      'functionName': 'get_service_acc_page'
     },
     'INFO'
   )
-  api_request = service.projects().serviceAccounts().list(name=project_id)
-  response = api_request.execute()
-  for name in data.get('exclude'):
+  return execute_request(api_request)
+
+
+def list_service_acc(context, project_id, page_size):
+  service_accounts = service.projects().serviceAccounts()
+  api_request = service_accounts.list(name=project_id, pageSize=page_size)
+  while api_request is not None:
+    response = get_service_acc_page(context, api_request)
     for service_account in response.get('accounts', []):
-      if service_account.get('displayName') == name \
-      or service_account.get('email') == name:
-        check_service_account = True
-        break
-    if check_service_account:
-      check_service_account = False
-      continue
-    send_msg_to_slack(
-      'Requested service account does not exist. \n `Service Account Name: '
-      + name + '`'
+      yield service_account
+    api_request = service_accounts.list_next(api_request, response)
+
+
+def execute_request(api_request):
+  method = metrics.get_method(api_request)
+  with metrics.google_api_seconds.labels(method=method).time(), \
+      transport_pool.http() as http:
+    return api_request.execute(http=http)
+
+
+def list_keys_request(project_id, email):
+  name = project_id + '/serviceAccounts/' + email
+  return keys_resource.list(name=name)
+
+
+@api_retry()
+def get_account_keys(context, project_id, email):
+  return execute_request(list_keys_request(project_id, email))
+
+
+def get_account_keys_batch(context, project_id, emails):
+  responses = dict()
+
+  def store_response(request_id, response, exception):
+    if exception is None:
+      responses[emails[int(request_id)]] = response
+
+  batch = service.new_batch_http_request(callback=store_response)
+  for request_id, email in enumerate(emails):
+    batch.add(list_keys_request(project_id, email), request_id=str(request_id))
+  try:
+    execute_request(batch)
+  except (HttpError, IOError) as err:
+    log_to_stackdriver(
+      context,
+      {
+        'message': 'Batch key listing failed, listing keys one by one.',
+        'error': str(err),
+        'functionName': 'get_account_keys_batch'
+      },
+      'WARNING'
+    )
+  for email in emails:
+    if email not in responses:
+      responses[email] = get_account_keys(context, project_id, email)
+  return responses
+
+
+def check_keys(context, email, threshold, response):
+  expired_keys = 0
+  now = utcnow()
+  for keys in response.get('keys', []):
+    if keys.get('keyType') == 'USER_MANAGED':
+      key_days = days_since(
+        parse_rfc3339(keys.get('validAfterTime')), now
+      )
+      if int(threshold) <= key_days:
+        expired_keys += 1
+        keys_flagged.inc()
+        notify_alert(
+          context, keys.get('name'), 'key_expired',
+          key_days // max(1, int(threshold)),
+          'Key Expired. Please generate new key. \n `Service Account: '
+          + email + '` \n `Key ID: ' + keys.get('name') + '`'
+        )
+  return expired_keys
+
+
+def get_chunk_keys(context, project_id, emails):
+  if len(emails) > 1:
+    return get_account_keys_batch(context, project_id, emails)
+  return {emails[0]: get_account_keys(context, project_id, emails[0])}
+
+
+def check_account_chunk(context, project_id, chunk):
+  started = time.monotonic()
+  try:
+    responses = get_chunk_keys(
+      context, project_id, [email for email, threshold in chunk]
     )
+  except HttpError as err:
+    log_to_stackdriver(
+      context,
+      {
+        'message': str(err),
+        'serviceAccEmails': [email for email, threshold in chunk],
+        'functionName': 'check_account_chunk'
+      },
+      'ERROR'
+    )
+    if is_retryable(err):
+      accounts_unchecked.inc(len(chunk))
+    return [
+      {
+        'type': 'serviceAccount',
+        'projectID': project_id.split('/', 1)[-1],
+        'email': email,
+        'error': str(err),
+        'unchecked': is_retryable(err),
+        'durationSeconds': round(time.monotonic() - started, 3)
+      }
+      for email, threshold in chunk
+    ]
+  accounts_checked.inc(len(chunk))
+  duration = round((time.monotonic() - started) / len(chunk), 3)
+  return [
+    {
+      'type': 'serviceAccount',
+      'projectID': project_id.split('/', 1)[-1],
+      'email': email,
+      'keys': len(responses[email].get('keys', [])),
+      'expiredKeys': check_keys(context, email, threshold, responses[email]),
+      'durationSeconds': duration
+    }
+    for email, threshold in chunk
+  ]
 
 
-@tenacity.retry(
-  wait=tenacity.wait_fixed(5),
-  stop=tenacity.stop_after_attempt(3),
-  retry=tenacity.retry_if_exception_type(ConnectionResetError) | 
-  tenacity.retry_if_exception_type(BrokenPipeError) |
-  tenacity.retry_if_exception_type(IOError))
-def check_account_keys(project_id, account_email):
+def check_account_keys(context, project_id, account_email, max_concurrency,
+                       batch_size, on_record=None):
   log_to_stackdriver(
+    context,
     {
       'message': 'Ckecking service account keys expiration.',
-      'serviceAccEmail': account_email,
+      'serviceAccCount': str(len(account_email)),
       'functionName': 'check_account_keys'  
     },
     'INFO'
   )
-  for email, threshold in account_email.items():
-    name = project_id + '/serviceAccounts/' + email
-    request = service.projects().serviceAccounts().keys().list(name=name)
-    response = request.execute()
-    for keys in response.get('keys', []):
-      if keys.get('keyType') == 'USER_MANAGED':
-        key_date = get_key_date(keys.get('validAfterTime'))
-        key_days = calculate_key_days(key_date)
-        if int(threshold) <= key_days:
-          send_msg_to_slack(
-            'Key Expired. Please generate new key. \n `Service Account: '
-            + email + '` \n `Key ID: ' + keys.get('name') + '`'
-          )			
-
-
-@tenacity.retry(
-  wait=tenacity.wait_fixed(5),
-  stop=tenacity.stop_after_attempt(3),
-  retry=tenacity.retry_if_exception_type(ConnectionResetError) | 
-  tenacity.retry_if_exception_type(BrokenPipeError) |
-  tenacity.retry_if_exception_type(IOError))
-def get_account_emails(project_id, req_service_accounts):
+  batch_size = max(1, int(batch_size))
+  context.retry_budget.add_items(-(-len(account_email) // batch_size))
+  expired_keys, failed_accounts, unchecked = 0, 0, list()
+  for records in iter_bounded_results(
+      (
+        (check_account_chunk, context, project_id, chunk)
+        for chunk in chunk_accounts(account_email.items(), batch_size)
+      ),
+      max_concurrency):
+    for record in records:
+      if 'error' in record:
+        failed_accounts += 1
+        if record['unchecked']:
+          unchecked.append(record['email'])
+      else:
+        expired_keys += record['expiredKeys']
+      if on_record is not None:
+        on_record(record)
+  report_unchecked_accounts(context, project_id, unchecked)
+  return expired_keys, failed_accounts
+
+
+def iter_bounded_results(tasks, max_concurrency):
+  max_concurrency = max(1, int(max_concurrency))
+  with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+    running = set()
+    for task in tasks:
+      running.add(executor.submit(*task))
+      if len(running) >= max_concurrency * 2:
+        done, running = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+          yield future.result()
+    while running:
+      done, running = wait(running, return_when=FIRST_COMPLETED)
+      for future in done:
+        yield future.result()
+
+
+def get_unchecked_reason(context):
+  if context.retry_budget.exhausted:
+    return 'API errors, retry budget exhausted'
+  return 'API errors'
+
+
+def report_unchecked_accounts(context, project_id, emails):
+  if not emails:
+    return
+  message = str(len(emails)) + ' service accounts in ' + project_id \
+    + ' could not be checked (' + get_unchecked_reason(context) \
+    + '). \n `Service Accounts: ' \
+    + ', '.join(emails[:MAX_REPORTED_UNCHECKED])
+  if len(emails) > MAX_REPORTED_UNCHECKED:
+    message += ' and ' + str(len(emails) - MAX_REPORTED_UNCHECKED) + ' more'
+  send_msg_to_slack(context, message + '`')
+
+
+def get_account_emails(context, service_accounts, data):
   log_to_stackdriver(
+    context,
     {
       'message': 'Getting service account emails from GCP.',
       'functionName': 'get_account_emails'  
     },
     'INFO'
   )
-  project_name = project_id
-  request = service.projects().serviceAccounts().list(name=project_name)
-  response = request.execute()
-  key_found = False
-  email_found = False
-  for key, value in req_service_accounts.items():
-    for service_account in response.get('accounts', []):
-      if service_account.get('displayName') == key or \
-      service_account.get('email') == key:
-        account_email[service_account.get('email')] = value
-        if value == 'None':
-          account_email[service_account.get('email')] = 90
-        key_found = True
-        break
-    if key_found:
-      key_found = False
-      continue
-    send_msg_to_slack(
-      'Requested service account does not exist. \n `Service Account Name: '
-      + key + '`'
+  account_email = dict()
+  exclude_names = set(data.get('exclude') or [])
+  req_service_accounts = data.get('threshold') or dict()
+  key_order = dict(
+    (key, order) for order, key in enumerate(req_service_accounts)
+  )
+  found_names, key_found = set(), set()
+  for service_account in service_accounts:
+    email = service_account.get('email')
+    names = set((service_account.get('displayName'), email))
+    found_names.update(names & exclude_names)
+    matched_keys = sorted(
+      (key for key in names if key in key_order and key not in key_found),
+      key=key_order.get
+    )
+    for key in matched_keys:
+      value = req_service_accounts[key]
+      account_email[email] = value
+      if value == 'None':
+        account_email[email] = 90
+      key_found.add(key)
+    if email not in account_email:
+      account_email[email] = 90
+  found_names.update(key_found)
+  return account_email, found_names
+
+
+def report_missing_accounts(context, data, found_names):
+  requested_names = list(data.get('exclude') or [])
+  requested_names.extend(data.get('threshold') or dict())
+  for name in requested_names:
+    if name not in found_names:
+      notify_alert(
+        context, name, 'account_missing', 'missing',
+        'Requested service account does not exist. \n `Service Account Name: '
+        + name + '`'
+      )
+
+
+@api_retry()
+def get_projects_page(context, api_request):
+  log_to_stackdriver(
+    context,
+    {
+      'message': 'Listing projects.',
+      'functionName': 'get_projects_page'
+    },
+    'INFO'
+  )
+  return execute_request(api_request)
+
+
+def list_projects(context, parent_type, parent_id):
+  projects = transport_pool.build('cloudresourcemanager', 'v1').projects()
+  api_request = projects.list(
+    filter='parent.type:' + parent_type + ' parent.id:' + str(parent_id)
+    + ' lifecycleState:ACTIVE'
+  )
+  while api_request is not None:
+    response = get_projects_page(context, api_request)
+    for project in response.get('projects', []):
+      yield project.get('projectId')
+    api_request = projects.list_next(api_request, response)
+
+
+@api_retry()
+def get_folders_page(context, api_request):
+  log_to_stackdriver(
+    context,
+    {
+      'message': 'Listing folders.',
+      'functionName': 'get_folders_page'
+    },
+    'INFO'
+  )
+  return execute_request(api_request)
+
+
+def list_folders(context, parent):
+  folders = transport_pool.build('cloudresourcemanager', 'v2').folders()
+  parents = [parent]
+  while parents:
+    api_request = folders.list(parent=parents.pop())
+    while api_request is not None:
+      response = get_folders_page(context, api_request)
+      for folder in response.get('folders', []):
+        yield folder.get('name').split('/')[-1]
+        parents.append(folder.get('name'))
+      api_request = folders.list_next(api_request, response)
+
+
+def list_descendant_projects(context, parent_type, parent_id):
+  for project_id in list_projects(context, parent_type, parent_id):
+    yield project_id
+  for folder_id in list_folders(context, parent_type + 's/' + str(parent_id)):
+    for project_id in list_projects(context, 'folder', folder_id):
+      yield project_id
+
+
+def get_project_ids(context, data):
+  project_ids = list()
+  if data.get('projectID'):
+    project_ids.append(data.get('projectID'))
+  project_ids.extend(data.get('projectIDs') or [])
+  if data.get('folderID'):
+    project_ids.extend(
+      list_descendant_projects(context, 'folder', data.get('folderID'))
+    )
+  if data.get('organizationID'):
+    project_ids.extend(
+      list_descendant_projects(
+        context, 'organization', data.get('organizationID')
+      )
+    )
+  return list(dict.fromkeys(project_ids))
+
+
+def check_project(context, req_project_id, data, on_record=None):
+  project_name = 'projects/' + req_project_id
+  try:
+    account_email, found_names = get_account_emails(
+      context,
+      list_service_acc(
+        context, project_name, data.get('pageSize', DEFAULT_PAGE_SIZE)
+      ),
+      data
+    )
+    expired_keys, failed_accounts = check_account_keys(
+      context, project_name, account_email,
+      data.get('maxConcurrency', DEFAULT_MAX_CONCURRENCY),
+      data.get('batchSize', DEFAULT_BATCH_SIZE),
+      on_record
+    )
+  except HttpError as err:
+    log_to_stackdriver(
+      context,
+      {
+        'message': str(err),
+        'projectID': req_project_id,
+        'functionName': 'check_project'
+      },
+      'ERROR'
+    )
+    if is_retryable(err):
+      send_msg_to_slack(
+        context,
+        'Service accounts could not be listed (' + get_unchecked_reason(context)
+        + '). \n `Project ID: ' + req_project_id + '`'
+      )
+    return {'error': str(err)}, None
+  return {
+    'serviceAccounts': len(account_email),
+    'expiredKeys': expired_keys,
+    'failedAccounts': failed_accounts
+  }, found_names
+
+
+def check_project_result(context, req_project_id, data, on_record=None):
+  summary, found_names = check_project(
+    context, req_project_id, data, on_record
+  )
+  return req_project_id, summary, found_names
+
+
+def check_projects(context, project_ids, data, on_record=None):
+  max_concurrency = data.get(
+    'maxProjectConcurrency', DEFAULT_MAX_PROJECT_CONCURRENCY
+  )
+  context.retry_budget.add_items(len(project_ids))
+  summaries, found_names, unlisted = dict(), set(), list()
+  for req_project_id, summary, project_found_names in iter_bounded_results(
+      (
+        (check_project_result, context, req_project_id, data, on_record)
+        for req_project_id in project_ids
+      ),
+      max_concurrency):
+    if on_record is None:
+      summaries[req_project_id] = summary
+    else:
+      on_record(dict(summary, type='project', projectID=req_project_id))
+    if project_found_names is None:
+      unlisted.append(req_project_id)
+    else:
+      found_names.update(project_found_names)
+  if unlisted:
+    # A requested account may be in a project which could not be listed.
+    log_to_stackdriver(
+      context,
+      {
+        'message': 'Skipping missing account check, service accounts of '
+                   + str(len(unlisted)) + ' projects could not be listed.',
+        'projectIDs': unlisted,
+        'functionName': 'check_projects'
+      },
+      'WARNING'
+    )
+  else:
+    report_missing_accounts(context, data, found_names)
+  return summaries
+
+
+@api_retry()
+def get_project_policy(context, project_id):
+  log_to_stackdriver(
+    context,
+    {
+      'message': 'Getting project IAM policy.',
+      'projectID': project_id,
+      'functionName': 'get_project_policy'
+    },
+    'INFO'
+  )
+  projects = transport_pool.build('cloudresourcemanager', 'v1').projects()
+  return execute_request(projects.getIamPolicy(resource=project_id, body={}))
+
+
+def chunk_accounts(service_accounts, batch_size):
+  chunk = list()
+  for service_account in service_accounts:
+    chunk.append(service_account)
+    if len(chunk) == batch_size:
+      yield chunk
+      chunk = list()
+  if chunk:
+    yield chunk
+
+
+def list_account_snapshots(context, project_name, data):
+  batch_size = max(1, int(data.get('batchSize', DEFAULT_BATCH_SIZE)))
+  max_concurrency = max(
+    1, int(data.get('maxConcurrency', DEFAULT_MAX_CONCURRENCY))
+  )
+  service_accounts = list_service_acc(
+    context, project_name, data.get('pageSize', DEFAULT_PAGE_SIZE)
+  )
+  pending = collections.deque()
+  with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+    for chunk in chunk_accounts(service_accounts, batch_size):
+      pending.append((chunk, executor.submit(
+        get_chunk_keys, context, project_name,
+        [service_account.get('email') for service_account in chunk]
+      )))
+      while len(pending) > max_concurrency:
+        chunk, future = pending.popleft()
+        responses = future.result()
+        for service_account in chunk:
+          yield service_account, responses[service_account.get('email')]
+    while pending:
+      chunk, future = pending.popleft()
+      responses = future.result()
+      for service_account in chunk:
+        yield service_account, responses[service_account.get('email')]
+
+
+def snapshot_project(context, req_project_id, sink, data):
+  index_name = req_project_id + '/index.json.gz'
+  previous = read_index(sink, index_name) or dict()
+  full = bool(data.get('fullSnapshot')) or not previous
+  previous_hashes = dict() if full else previous.get('records', dict())
+  snapshot_time = utcnow().strftime('%Y%m%dT%H%M%SZ')
+  snapshot_name = req_project_id + '/' + snapshot_time \
+    + ('-full' if full else '-diff') + '.ndjson.gz'
+  writer = SnapshotWriter(sink, snapshot_name)
+  record_hashes = dict()
+  summary = {
+    'serviceAccounts': 0,
+    'keys': 0,
+    'changedRecords': 0,
+    'deletedRecords': 0
+  }
+
+  def add_record(key, record):
+    record_hash = content_hash(record)
+    record_hashes[key] = record_hash
+    if previous_hashes.get(key) != record_hash:
+      writer.write(
+        {'op': 'upsert', 'key': key, 'hash': record_hash, 'record': record}
+      )
+      summary['changedRecords'] += 1
+
+  try:
+    add_record('iamPolicy', get_project_policy(context, req_project_id))
+    for service_account, response in list_account_snapshots(
+        context, 'projects/' + req_project_id, data):
+      keys = response.get('keys', [])
+      summary['serviceAccounts'] += 1
+      summary['keys'] += len(keys)
+      add_record(
+        'serviceAccount/' + service_account.get('email'),
+        {'serviceAccount': service_account, 'keys': keys}
+      )
+    for key in previous_hashes:
+      if key not in record_hashes:
+        writer.write({'op': 'delete', 'key': key})
+        summary['deletedRecords'] += 1
+    summary['contentHash'] = content_hash(sorted(record_hashes.items()))
+    if not writer.commit():
+      summary['snapshot'] = None
+      summary['type'] = 'unchanged'
+      return summary
+    snapshots = [snapshot_name]
+    if not full:
+      snapshots = previous.get('snapshots', []) + snapshots
+    write_index(sink, index_name, {
+      'contentHash': summary['contentHash'],
+      'records': record_hashes,
+      'snapshots': snapshots,
+      'updated': snapshot_time
+    })
+  except HttpError as err:
+    log_to_stackdriver(
+      context,
+      {
+        'message': str(err),
+        'projectID': req_project_id,
+        'functionName': 'snapshot_project'
+      },
+      'ERROR'
     )
-  for service_account in response.get('accounts', []):
-    for key, value in account_email.items():
-      if service_account.get('displayName') == key or \
-      service_account.get('email') == key:
-        email_found= True
-        break
-    if email_found:
-      email_found = False
-      continue
-    account_email[service_account.get('email')] = 90
-  check_account_keys(project_id, account_email)
-
-
-def catch_error(error_type, err, instance):
+    return {'error': str(err)}
+  finally:
+    writer.discard()
+  log_to_stackdriver(
+    context,
+    {
+      'message': 'Snapshot written.',
+      'projectID': req_project_id,
+      'snapshot': snapshot_name,
+      'changedRecords': str(summary['changedRecords']),
+      'functionName': 'snapshot_project'
+    },
+    'INFO'
+  )
+  summary['snapshot'] = snapshot_name
+  summary['type'] = 'full' if full else 'diff'
+  return summary
+
+
+def snapshot_projects(context, project_ids, sink, data):
+  max_concurrency = data.get(
+    'maxProjectConcurrency', DEFAULT_MAX_PROJECT_CONCURRENCY
+  )
+  context.retry_budget.add_items(len(project_ids))
+  with ThreadPoolExecutor(max_workers=max(1, int(max_concurrency))) as executor:
+    futures = [
+      (
+        req_project_id,
+        executor.submit(snapshot_project, context, req_project_id, sink, data)
+      )
+      for req_project_id in project_ids
+    ]
+  return dict(
+    (req_project_id, future.result()) for req_project_id, future in futures
+  )
+
+
+def catch_error(context, error_type, err, instance):
+  metrics.errors.labels(category=error_type).inc()
   exc_type, exc_obj, exc_tb = sys.exc_info()
   if error_type == 'BadRequest':
     return jsonify({"error": str(err)}), 400
   log_to_stackdriver(
+    context,
     {
       'message': str(err),
       'codeLineNo': str(exc_tb.tb_lineno)
@@ -237,7 +851,7 @@ def catch_error(error_type, err, instance):
     'ERROR'
   )
   if error_type == 'Exception':
-    send_msg_to_slack('Error: ' + str(err))
+    send_msg_to_slack(context, 'Error: ' + str(err))
     return jsonify({
       "error": str(err),
       "codeLineNo": str(exc_tb.tb_lineno)
@@ -251,66 +865,223 @@ def catch_error(error_type, err, instance):
 
 def set_metadata(req_channel_name, req_project_id, req_service_name,
                  req_region, req_slack_token):
-  global channel_name, project_id, service_name, region
-  
-  service_name = req_service_name
-  region = req_region
-  channel_name = req_channel_name
   if req_project_id is None:
-    return True, jsonify({"error": 'Please provide projectID'}), 403
-  elif service_name is None:
-    return True, jsonify({"error": 'Please provide serviceName'}), 403
-  elif region is None:
-    return True, jsonify({"error": 'Please provide region'}), 403
-  elif channel_name is None:
-    return True, jsonify({"error": 'Please provide slackChannelName'}),
-    403
+    return None, jsonify({"error": 'Please provide projectID'}), 403
+  elif req_service_name is None:
+    return None, jsonify({"error": 'Please provide serviceName'}), 403
+  elif req_region is None:
+    return None, jsonify({"error": 'Please provide region'}), 403
+  elif req_channel_name is None:
+    return None, jsonify({"error": 'Please provide slackChannelName'}), 403
   elif req_slack_token is None:
-    return True, jsonify({"error": 'Please provide slackToken'}), 403
+    return None, jsonify({"error": 'Please provide slackToken'}), 403
   else:
-    project_id = 'projects/' + req_project_id
-    set_token(req_slack_token)
-    global cloud_run_resource
-    cloud_run_resource = Resource(
-      type='cloud_run_revision',
-      labels={
-        'project_id': project_id,
-        'service_name': service_name,
-        'region': region
-      }
+    context = RequestContext(
+      'projects/' + req_project_id, req_service_name, req_region,
+      req_channel_name, req_slack_token
+    )
+    return context, str(), 0
+
+
+def wants_stream(data):
+  return bool(data.get('stream')) \
+    or 'application/x-ndjson' in request.headers.get('Accept', str())
+
+
+def stream_records(records):
+  return app.response_class(
+    stream_with_context(
+      json.dumps(record, sort_keys=True) + '\n' for record in records
+    ),
+    mimetype='application/x-ndjson'
+  )
+
+
+def stream_project_checks(context, project_ids, data):
+  records = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+  closed = threading.Event()
+
+  def put_record(record):
+    while not closed.is_set():
+      try:
+        records.put(record, timeout=1)
+        return
+      except queue.Full:
+        pass
+
+  def run():
+    try:
+      check_projects(context, project_ids, data, put_record)
+    except Exception as err:
+      error, err_code = catch_error(context, 'Exception', err, str())
+      put_record({
+        'type': 'error',
+        'error': error.get_json().get('error'),
+        'errorCode': err_code
+      })
+    finally:
+      flush_notifications(context)
+      put_record(None)
+
+  worker = threading.Thread(target=app_context_call, args=(run,), daemon=True)
+  worker.start()
+  try:
+    while True:
+      record = records.get()
+      if record is None:
+        return
+      yield record
+  finally:
+    closed.set()
+
+
+def app_context_call(function):
+  with app.app_context():
+    function()
+
+
+def get_request_context(data):
+  req_project_id = data.get('projectID')
+  if req_project_id is None and (data.get('projectIDs')
+                                 or data.get('folderID')
+                                 or data.get('organizationID')):
+    req_project_id = project
+  context, message, err_code = set_metadata(
+    data.get('slackChannelName'), req_project_id,
+    data.get('serviceName'), data.get('region'), data.get('slackToken')
+  )
+  if context is not None:
+    context.retry_budget = RetryBudget(
+      data.get('retryBudget', DEFAULT_RETRY_BUDGET),
+      data.get('retryBudgetPerItem', DEFAULT_RETRY_BUDGET_PER_ITEM)
     )
-    return False, str(), 0
+  return context, message, err_code
 
 
-@tenacity.retry(
-  wait=tenacity.wait_fixed(5),
-  stop=tenacity.stop_after_attempt(3),
-  retry=tenacity.retry_if_exception_type(ConnectionResetError) | 
-  tenacity.retry_if_exception_type(BrokenPipeError) |
-  tenacity.retry_if_exception_type(IOError))
 @app.route('/', methods=['POST'])
 def check_service_account():
+  context = None
   try:
     data = request.get_json(force=True)
-    error, message, err_code = set_metadata(
-      data.get('slackChannelName'), data.get('projectID'),
-      data.get('serviceName'), data.get('region'), data.get('slackToken')
-    )
-    if error:
+    context, message, err_code = get_request_context(data)
+    if context is None:
       return message, err_code
-    list_service_acc(project_id, data)
-    get_account_emails(
-      project_id,
-      data.get('threshold')
-    )		
-    return jsonify({"info": "Processes successfully initiated."}), 200
+    context.renotify_interval = float(
+      data.get('renotifyMinutes', DEFAULT_RENOTIFY_MINUTES)
+    ) * 60
+    project_ids = get_project_ids(context, data)
+    report_title = 'Service account key report for ' + context.project_id
+    if len(project_ids) > 1:
+      report_title = 'Service account key report for ' \
+        + str(len(project_ids)) + ' projects'
+    start_notifications(context, data.get('notificationMode'), report_title)
+    if wants_stream(data):
+      return stream_records(stream_project_checks(context, project_ids, data))
+    try:
+      summaries = check_projects(context, project_ids, data)
+    finally:
+      flush_notifications(context)
+    return jsonify({
+      "info": "Processes successfully initiated.",
+      "projects": summaries
+    }), 200
   except BadRequest as err:
-    error, err_code = catch_error('BadRequest', err, str())
+    error, err_code = catch_error(context, 'BadRequest', err, str())
     return error, err_code	
+  except HttpError as err:
+    error, err_code = catch_error(context, 'HttpError', err, str())
+    return error, err_code
 #   except Exception as err:
 #     error, err_code = catch_error('Exception', err, str())
 #     return error, err_code
 
 
+def get_snapshot_sink(data):
+  for option in ('pageSize', 'batchSize', 'maxConcurrency',
+                 'maxProjectConcurrency'):
+    try:
+      int(data.get(option, 0))
+    except (TypeError, ValueError):
+      raise BadRequest('Invalid ' + option + ': ' + str(data.get(option)))
+  try:
+    return open_snapshot_sink(
+      data.get('snapshotDestination')
+      or os.environ.get('SNAPSHOT_DESTINATION', DEFAULT_SNAPSHOT_DESTINATION)
+    )
+  except ValueError as err:
+    raise BadRequest(str(err))
+
+
+@app.route('/snapshot', methods=['POST'])
+def snapshot_service_accounts():
+  context = None
+  try:
+    data = request.get_json(force=True)
+    context, message, err_code = get_request_context(data)
+    if context is None:
+      return message, err_code
+    sink = get_snapshot_sink(data)
+    project_ids = get_project_ids(context, data)
+    return jsonify({
+      "info": "Snapshots written.",
+      "projects": snapshot_projects(context, project_ids, sink, data)
+    }), 200
+  except BadRequest as err:
+    error, err_code = catch_error(context, 'BadRequest', err, str())
+    return error, err_code
+  except HttpError as err:
+    error, err_code = catch_error(context, 'HttpError', err, str())
+    return error, err_code
+  except Exception as err:
+    error, err_code = catch_error(context, 'Exception', err, str())
+    return error, err_code
+
+
+@app.route('/slackCacheStats', methods=['GET'])
+def slack_cache_stats():
+  return jsonify(channel_cache.stats()), 200
+
+
+@app.route('/slackQueueStats', methods=['GET'])
+def slack_queue_stats():
+  return jsonify(slack_dispatcher.stats()), 200
+
+
+@app.route('/retryStats', methods=['GET'])
+def retry_stats():
+  return jsonify(retry_counters.stats()), 200
+
+
+@app.route('/transportStats', methods=['GET'])
+def transport_stats():
+  return jsonify(transport_pool.stats()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def export_metrics():
+  body, content_type = metrics.render(request.headers.get('Accept'))
+  return body, 200, {'Content-Type': content_type}
+
+
+metrics.register_stats('transport', transport_pool.stats)
+metrics.register_stats('slack_queue', slack_dispatcher.stats)
+metrics.register_stats('slack_channel_cache', channel_cache.stats)
+metrics.register_stats('log_sink', log_sink.stats)
+metrics.register_stats(
+  'api_retry_events', retry_counters.stats,
+  labels=('function', 'outcome', 'reason'), counter=True
+)
+
+
+log_to_stackdriver(
+  None,
+  {
+    'message': 'Application loaded.',
+    'loadSeconds': str(round(time.monotonic() - load_started, 3))
+  },
+  'INFO'
+)
+
+
 if __name__ == '__main__':
   app.run(host='0.0.0.0')
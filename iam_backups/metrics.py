@@ -0,0 +1,100 @@
+import re
+
+import prometheus_client
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.openmetrics import exposition as openmetrics
+
+
+API_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+REQUEST_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+google_api_seconds = Histogram(
+  'google_api_request_duration_seconds',
+  'Duration of Google API calls.',
+  ['method'], buckets=API_BUCKETS
+)
+slack_api_seconds = Histogram(
+  'slack_api_request_duration_seconds',
+  'Duration of Slack API calls.',
+  ['method'], buckets=API_BUCKETS
+)
+logging_write_seconds = Histogram(
+  'logging_write_duration_seconds',
+  'Duration of batched Stackdriver log writes.',
+  buckets=API_BUCKETS
+)
+request_seconds = Histogram(
+  'http_request_duration_seconds',
+  'End to end duration of HTTP requests.',
+  ['endpoint', 'status'], buckets=REQUEST_BUCKETS
+)
+errors = Counter(
+  'errors',
+  'Errors handled by catch_error, by category.',
+  ['category']
+)
+
+
+def get_method(api_request):
+  return getattr(api_request, 'methodId', None) or type(api_request).__name__
+
+
+def to_snake_case(name):
+  return re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
+
+
+class StatsCollector(object):
+
+  def __init__(self, prefix, stats_function, labels=(), counter=False):
+    self.prefix = prefix
+    self.stats_function = stats_function
+    self.labels = list(labels)
+    self.counter = counter
+
+  def collect(self):
+    stats = self.stats_function()
+    if self.labels:
+      family = self.new_family(self.prefix, self.labels)
+      self.add_samples(family, stats, [])
+      yield family
+      return
+    for key, value in sorted(stats.items()):
+      if isinstance(value, (int, float)):
+        family = self.new_family(
+          self.prefix + '_' + to_snake_case(key), []
+        )
+        family.add_metric([], value)
+        yield family
+
+  def new_family(self, name, labels):
+    if self.counter:
+      return CounterMetricFamily(name, name.replace('_', ' ') + '.',
+                                 labels=labels)
+    return GaugeMetricFamily(name, name.replace('_', ' ') + '.',
+                             labels=labels)
+
+  def add_samples(self, family, stats, label_values):
+    for key, value in stats.items():
+      if isinstance(value, dict):
+        self.add_samples(family, value, label_values + [str(key)])
+      elif len(label_values) + 1 == len(self.labels):
+        family.add_metric(label_values + [str(key)], value)
+
+
+def register_stats(prefix, stats_function, labels=(), counter=False):
+  prometheus_client.REGISTRY.register(
+    StatsCollector(prefix, stats_function, labels, counter)
+  )
+
+
+def render(accept_header):
+  if 'application/openmetrics-text' in (accept_header or ''):
+    return (
+      openmetrics.generate_latest(prometheus_client.REGISTRY),
+      openmetrics.CONTENT_TYPE_LATEST
+    )
+  return (
+    prometheus_client.generate_latest(prometheus_client.REGISTRY),
+    prometheus_client.CONTENT_TYPE_LATEST
+  )
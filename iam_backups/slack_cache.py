@@ -0,0 +1,50 @@
+import threading
+import time
+
+
+CHANNEL_CACHE_TTL_SECONDS = 300
+
+
+class ChannelCache(object):
+
+  def __init__(self, ttl=CHANNEL_CACHE_TTL_SECONDS):
+    self.ttl = ttl
+    self.channels = dict()
+    self.hits, self.misses, self.invalidations = 0, 0, 0
+    self.lock = threading.Lock()
+
+  def get_channel_id(self, token, channel_name, list_channels):
+    with self.lock:
+      entry = self.channels.get((token, channel_name))
+      if entry and entry[1] > time.monotonic():
+        self.hits += 1
+        return entry[0]
+      self.misses += 1
+    channels = list_channels()
+    if not channels:
+      return None
+    expires_at = time.monotonic() + self.ttl
+    with self.lock:
+      for channel in channels:
+        self.channels[(token, channel['name'])] = (channel['id'], expires_at)
+      entry = self.channels.get((token, channel_name))
+    if entry:
+      return entry[0]
+    return None
+
+  def invalidate(self, token, channel_name):
+    with self.lock:
+      if self.channels.pop((token, channel_name), None):
+        self.invalidations += 1
+
+  def stats(self):
+    with self.lock:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'invalidations': self.invalidations,
+        'size': len(self.channels)
+      }
+
+
+channel_cache = ChannelCache()
@@ -0,0 +1,169 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+
+DEFAULT_SNAPSHOT_DESTINATION = 'file:///tmp/iam-snapshots'
+GCS_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def canonical_json(value):
+  return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def content_hash(value):
+  return hashlib.sha256(canonical_json(value).encode('utf-8')).hexdigest()[:32]
+
+
+class LocalSnapshotFile(object):
+
+  def __init__(self, path):
+    self.path = path
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, self.temp_path = tempfile.mkstemp(
+      dir=directory, prefix='.', suffix='.tmp'
+    )
+    self.file = os.fdopen(descriptor, 'wb')
+
+  def write(self, data):
+    return self.file.write(data)
+
+  def flush(self):
+    self.file.flush()
+
+  def commit(self):
+    self.file.close()
+    os.replace(self.temp_path, self.path)
+
+  def discard(self):
+    self.file.close()
+    if os.path.exists(self.temp_path):
+      os.remove(self.temp_path)
+
+
+class LocalSnapshotSink(object):
+
+  def __init__(self, root):
+    self.root = root
+
+  def path(self, name):
+    return os.path.join(self.root, *name.split('/'))
+
+  def read(self, name):
+    try:
+      with open(self.path(name), 'rb') as snapshot_file:
+        return snapshot_file.read()
+    except FileNotFoundError:
+      return None
+
+  def open(self, name):
+    return LocalSnapshotFile(self.path(name))
+
+
+class GCSSnapshotFile(object):
+
+  def __init__(self, blob):
+    self.blob = blob
+    self.file = blob.open('wb', chunk_size=GCS_CHUNK_SIZE)
+
+  def write(self, data):
+    return self.file.write(data)
+
+  def flush(self):
+    pass
+
+  def commit(self):
+    self.file.close()
+
+  def discard(self):
+    from google.cloud.exceptions import NotFound
+    self.file.close()
+    try:
+      self.blob.delete()
+    except NotFound:
+      pass
+
+
+class GCSSnapshotSink(object):
+
+  def __init__(self, bucket_name, prefix):
+    from google.cloud import storage
+    self.bucket = storage.Client().bucket(bucket_name)
+    self.prefix = prefix.strip('/')
+
+  def blob(self, name):
+    return self.bucket.blob('/'.join(filter(None, [self.prefix, name])))
+
+  def read(self, name):
+    from google.cloud.exceptions import NotFound
+    try:
+      return self.blob(name).download_as_string()
+    except NotFound:
+      return None
+
+  def open(self, name):
+    return GCSSnapshotFile(self.blob(name))
+
+
+def open_snapshot_sink(url):
+  scheme, _, location = url.partition('://')
+  if scheme == 'file':
+    return LocalSnapshotSink(location)
+  elif scheme == 'gs':
+    bucket_name, _, prefix = location.partition('/')
+    return GCSSnapshotSink(bucket_name, prefix)
+  elif not location:
+    return LocalSnapshotSink(url)
+  raise ValueError('Unsupported snapshot destination: ' + url)
+
+
+def read_index(sink, name):
+  content = sink.read(name)
+  if content is None:
+    return None
+  return json.loads(gzip.decompress(content).decode('utf-8'))
+
+
+def write_index(sink, name, index):
+  target = sink.open(name)
+  try:
+    target.write(gzip.compress(canonical_json(index).encode('utf-8')))
+  except Exception:
+    target.discard()
+    raise
+  target.commit()
+
+
+class SnapshotWriter(object):
+
+  def __init__(self, sink, name):
+    self.sink = sink
+    self.name = name
+    self.target = None
+    self.stream = None
+
+  def write(self, line):
+    if self.stream is None:
+      self.target = self.sink.open(self.name)
+      self.stream = gzip.GzipFile(
+        filename='', mode='wb', fileobj=self.target, mtime=0
+      )
+    self.stream.write(canonical_json(line).encode('utf-8') + b'\n')
+
+  def commit(self):
+    if self.stream is None:
+      return False
+    stream, self.stream = self.stream, None
+    stream.close()
+    self.target.commit()
+    return True
+
+  def discard(self):
+    if self.stream is None:
+      return
+    stream, self.stream = self.stream, None
+    stream.close()
+    self.target.discard()
@@ -1,10 +1,7 @@
 set -e
 
-cloneRepo() {
-  gcloud source repos clone $scriptRepoName
-  cd $scriptRepoName
-  git checkout $branch
-  python3 $fileName
+startServer() {
+  exec gunicorn --config gunicorn.conf.py iam_backup:app
 }
 
-cloneRepo
\ No newline at end of file
+startServer
@@ -0,0 +1,132 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_STATE_STORE = 'sqlite:///tmp/cloud-run-state.db'
+
+
+class MemoryStateStore(object):
+
+  def __init__(self):
+    self.items = dict()
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock:
+      value = self.items.get(key)
+    if value is None:
+      return None
+    return json.loads(value)
+
+  def put(self, key, value):
+    with self.lock:
+      self.items[key] = json.dumps(value)
+
+  def delete(self, key):
+    with self.lock:
+      self.items.pop(key, None)
+
+
+class SQLiteStateStore(object):
+
+  def __init__(self, path):
+    self.connection = sqlite3.connect(path, check_same_thread=False)
+    self.lock = threading.Lock()
+    with self.lock, self.connection:
+      self.connection.execute(
+        'CREATE TABLE IF NOT EXISTS state '
+        '(key TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL)'
+      )
+
+  def get(self, key):
+    with self.lock:
+      row = self.connection.execute(
+        'SELECT value FROM state WHERE key = ?', (key,)
+      ).fetchone()
+    if row is None:
+      return None
+    return json.loads(row[0])
+
+  def put(self, key, value):
+    with self.lock, self.connection:
+      self.connection.execute(
+        'INSERT OR REPLACE INTO state (key, value, updated) VALUES (?, ?, ?)',
+        (key, json.dumps(value), time.time())
+      )
+
+  def delete(self, key):
+    with self.lock, self.connection:
+      self.connection.execute('DELETE FROM state WHERE key = ?', (key,))
+
+
+class GCSStateStore(object):
+
+  def __init__(self, bucket_name, prefix):
+    from google.cloud import storage
+    self.bucket = storage.Client().bucket(bucket_name)
+    self.prefix = prefix.strip('/')
+
+  def blob(self, key):
+    return self.bucket.blob('/'.join(filter(None, [self.prefix, key])))
+
+  def get(self, key):
+    from google.cloud.exceptions import NotFound
+    try:
+      return json.loads(self.blob(key).download_as_string())
+    except NotFound:
+      return None
+
+  def put(self, key, value):
+    self.blob(key).upload_from_string(
+      json.dumps(value), content_type='application/json'
+    )
+
+  def delete(self, key):
+    from google.cloud.exceptions import NotFound
+    try:
+      self.blob(key).delete()
+    except NotFound:
+      pass
+
+
+class FirestoreStateStore(object):
+
+  def __init__(self, collection):
+    from google.cloud import firestore
+    self.collection = firestore.Client().collection(collection)
+
+  def document(self, key):
+    return self.collection.document(key.replace('/', ':'))
+
+  def get(self, key):
+    snapshot = self.document(key).get()
+    if not snapshot.exists:
+      return None
+    return json.loads(snapshot.to_dict()['value'])
+
+  def put(self, key, value):
+    self.document(key).set({'value': json.dumps(value)})
+
+  def delete(self, key):
+    self.document(key).delete()
+
+
+def open_state_store(url):
+  scheme, _, location = url.partition('://')
+  if scheme == 'memory':
+    return MemoryStateStore()
+  elif scheme == 'sqlite':
+    return SQLiteStateStore(location)
+  elif scheme == 'gs':
+    bucket_name, _, prefix = location.partition('/')
+    return GCSStateStore(bucket_name, prefix)
+  elif scheme == 'firestore':
+    return FirestoreStateStore(location)
+  raise ValueError('Unsupported state store: ' + url)
+
+
+def state_store_from_env():
+  return open_state_store(os.environ.get('STATE_STORE', DEFAULT_STATE_STORE))
@@ -0,0 +1,186 @@
+import contextlib
+import os
+import queue
+import threading
+
+import google.auth
+import google_auth_httplib2
+import httplib2
+import requests
+from googleapiclient import discovery
+from slackclient import SlackClient
+from slackclient.slackrequest import SlackRequest
+
+
+SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+
+class CountingAuthorizedHttp(google_auth_httplib2.AuthorizedHttp):
+
+  def __init__(self, credentials, http, counter):
+    super(CountingAuthorizedHttp, self).__init__(credentials, http=http)
+    self.counter = counter
+
+  def request(self, *args, **kwargs):
+    connections = len(self.http.connections)
+    try:
+      return super(CountingAuthorizedHttp, self).request(*args, **kwargs)
+    finally:
+      self.counter(
+        'googleRequests', 1,
+        'googleConnectionsOpened',
+        max(0, len(self.http.connections) - connections)
+      )
+
+
+class PooledSlackRequest(SlackRequest):
+
+  def __init__(self, session, counter, proxies=None):
+    super(PooledSlackRequest, self).__init__(proxies=proxies)
+    self.session = session
+    self.counter = counter
+
+  def post_http_request(self, token, api_method, post_data,
+                        files=None, timeout=None, domain='slack.com'):
+    if post_data is not None and 'token' in post_data:
+      token = post_data['token']
+    self.counter('slackRequests', 1)
+    return self.session.post(
+      'https://' + domain + '/api/' + api_method,
+      headers={
+        'user-agent': self.get_user_agent(),
+        'Authorization': 'Bearer ' + str(token)
+      },
+      data=post_data,
+      files=files,
+      timeout=timeout,
+      proxies=self.proxies
+    )
+
+
+class TransportPool(object):
+
+  def __init__(self, credentials=None, pool_size=10, timeout=60):
+    self.credentials = credentials
+    self.pool_size = pool_size
+    self.timeout = timeout
+    self.idle = queue.LifoQueue(maxsize=pool_size)
+    self.services = dict()
+    self.slack_clients = dict()
+    self.slack_session = None
+    self.lock = threading.Lock()
+    self.counters = {
+      'googleSessionsCreated': 0,
+      'googleSessionsReused': 0,
+      'googleSessionsDiscarded': 0,
+      'googleRequests': 0,
+      'googleConnectionsOpened': 0,
+      'slackClientsCreated': 0,
+      'slackClientsReused': 0,
+      'slackRequests': 0
+    }
+
+  @classmethod
+  def from_env(cls, credentials=None):
+    return cls(
+      credentials=credentials,
+      pool_size=int(os.environ.get('HTTP_POOL_SIZE', 10)),
+      timeout=float(os.environ.get('HTTP_TIMEOUT', 60))
+    )
+
+  def count(self, *names_and_values):
+    with self.lock:
+      for index in range(0, len(names_and_values), 2):
+        self.counters[names_and_values[index]] += names_and_values[index + 1]
+
+  def get_credentials(self):
+    with self.lock:
+      if self.credentials is None:
+        self.credentials, _ = google.auth.default(scopes=SCOPES)
+      return self.credentials
+
+  def build(self, api, version):
+    key = api + '/' + version
+    with self.lock:
+      service = self.services.get(key)
+    if service is None:
+      service = discovery.build(
+        api, version, credentials=self.get_credentials(),
+        static_discovery=True
+      )
+      with self.lock:
+        service = self.services.setdefault(key, service)
+    return service
+
+  def new_http(self):
+    self.count('googleSessionsCreated', 1)
+    return CountingAuthorizedHttp(
+      self.get_credentials(),
+      httplib2.Http(timeout=self.timeout),
+      self.count
+    )
+
+  @contextlib.contextmanager
+  def http(self):
+    try:
+      http = self.idle.get_nowait()
+      self.count('googleSessionsReused', 1)
+    except queue.Empty:
+      http = self.new_http()
+    try:
+      yield http
+    except (IOError, httplib2.HttpLib2Error):
+      # A failed call may leave a half-read connection behind.
+      http.http.close()
+      raise
+    finally:
+      try:
+        self.idle.put_nowait(http)
+      except queue.Full:
+        http.http.close()
+        self.count('googleSessionsDiscarded', 1)
+
+  def get_slack_session(self):
+    if self.slack_session is None:
+      self.slack_session = requests.Session()
+      adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=self.pool_size
+      )
+      self.slack_session.mount('https://', adapter)
+    return self.slack_session
+
+  def get_slack_client(self, token):
+    with self.lock:
+      slack_client = self.slack_clients.get(token)
+      if slack_client is not None:
+        self.counters['slackClientsReused'] += 1
+        return slack_client
+      slack_client = SlackClient(token)
+      slack_client.server.api_requester = PooledSlackRequest(
+        self.get_slack_session(), self.count, slack_client.server.proxies
+      )
+      self.slack_clients[token] = slack_client
+      self.counters['slackClientsCreated'] += 1
+      return slack_client
+
+  def stats(self):
+    with self.lock:
+      stats = dict(self.counters)
+      slack_session = self.slack_session
+    stats['googleSessionsIdle'] = self.idle.qsize()
+    stats['slackConnectionsOpened'] = 0
+    if slack_session is not None:
+      for adapter in slack_session.adapters.values():
+        pools = getattr(adapter, 'poolmanager', None)
+        pools = pools.pools if pools is not None else dict()
+        for key in list(pools.keys()):
+          pool = pools.get(key)
+          if pool is not None:
+            stats['slackConnectionsOpened'] += pool.num_connections
+    stats['googleConnectionsReused'] = max(
+      0, stats['googleRequests'] - stats['googleConnectionsOpened']
+    )
+    stats['slackConnectionsReused'] = max(
+      0, stats['slackRequests'] - stats['slackConnectionsOpened']
+    )
+    return stats